@@ -4,6 +4,7 @@
 #  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
 """Perform CTC Re-Segmentation on japanese dataset.
 Either start this program as a script or from the interactive python REPL.
+Other languages are aligned with `--lang` and an ASR model of that language.
 
 # Recommended model:
 # Japanese Transformer Model by Shinji (note: this model has FRAMES_PER_INDEX=768 )
@@ -15,7 +16,13 @@ align(wavdir=dir_wav, txtdir=dir_txt, output=output, ngpu=ngpu, longest_audio_se
 """
 
 import argparse
+import hashlib
+import json
 import logging
+import os
+import shutil
+import signal
+from queue import Empty, Full
 import sys
 import time
 from typing import Union
@@ -27,6 +34,7 @@ from typeguard import check_argument_types
 from espnet.utils.cli_utils import get_commandline_args
 from espnet2.utils import config_argparse
 from espnet2.utils.types import str_or_none
+from espnet2.torch_utils.device_funcs import to_device
 
 from pathlib import Path
 import soundfile
@@ -35,57 +43,19 @@ from espnet2.bin.asr_align import CTCSegmentation
 from torch.multiprocessing import Process, Queue
 from espnet2.utils.types import str2bool
 
-# Language specific imports - japanese
-from num2words import num2words
-import re
-
-try:
-    import neologdn
-
-    NEOLOGDN_AVAILABLE = True
-except:
-    print("ERROR: neologdn is not available!")
-    NEOLOGDN_AVAILABLE = False
-try:
-    import romkan
-
-    ROMKAN_AVAILABLE = True
-except:
-    print("ERROR: romkan is not available!")
-    ROMKAN_AVAILABLE = False
+# Language specific text normalization (see text_frontend.py)
+from text_frontend import get_frontend
+from segment_store import SegmentWriter
+# Audio files (wav or flac) are read with soundfile
+from audio import AUDIO_FORMATS
 
 # NUMBER_OF_PROCESSES determines how many CTC segmentation workers
-# are started. Set this higher or lower, depending how fast your
-# network can do the inference and how much RAM you have
+# are started by default (see --num_workers). Set this higher or lower,
+# depending how fast your network can do the inference and how much RAM
+# you have
 NUMBER_OF_PROCESSES = 4
 
 
-def text_processing(utt_txt):
-    """Normalize text.
-    Use for Japanese text.
-    Args:
-        utt_txt: String of Japanese text.
-    Returns:
-        utt_txt: Normalized
-    """
-    # convert UTF-16 latin chars to ASCII
-    if NEOLOGDN_AVAILABLE:
-        utt_txt = neologdn.normalize(utt_txt)
-    # Romanji to Hiragana
-    if ROMKAN_AVAILABLE:
-        utt_txt = romkan.to_hiragana(utt_txt)
-    # replace some special characters
-    utt_txt = utt_txt.replace('"', "").replace(",", "")
-    # replace all the numbers
-    numbers = re.findall(r"\d+\.?\d*", utt_txt)
-    transcribed_numbers = [num2words(item, lang="ja") for item in numbers]
-    for nr in range(len(numbers)):
-        old_nr = numbers[nr]
-        new_nr = transcribed_numbers[nr]
-        utt_txt = utt_txt.replace(old_nr, new_nr, 1)
-    return utt_txt
-
-
 def get_partitions(
     t: int = 100000,
     max_len_s: float = 1280.0,
@@ -158,58 +128,652 @@ def get_partitions(
 
 
 def align_worker(in_queue, out_queue, num=0):
+    # Ctrl-C is handled by the main process, which drains the queue
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
     print(f"align_worker {num} started")
     for task in iter(in_queue.get, "STOP"):
         try:
+            # lpz of the LPZ cache are passed by path (see LpzCache)
+            if isinstance(task.lpz, str):
+                task.lpz = load_lpz(task.lpz)
             result = CTCSegmentation.get_segments(task)
             task.set(**result)
             segments_str = str(task)
-            out_queue.put(segments_str)
             # calculate average score
             scores = [boundary[2] for boundary in task.segments]
             avg = sum(scores) / len(scores)
+            record = {
+                "utt_ids": list(task.utt_ids),
+                "segments": [tuple(boundary) for boundary in task.segments],
+                "text": list(task.text),
+            }
+            out_queue.put(("done", task.name, (segments_str, record)))
             logging.info(f"Aligned {task.name} with avg score {avg:3.4f}")
-        except (AssertionError, IndexError) as e:
+        except Exception as e:
             # AssertionError: Audio is shorter than ground truth
             # IndexError: backtracking not successful (e.g. audio-text mismatch)
-            logging.error(
-                f"Failed to align {task.utt_ids[0]} in {task.name} because of: {e}"
-            )
+            reason = f"Failed to align {task.utt_ids[0]} in {task.name} because of: {e}"
+            out_queue.put(("failed", task.name, reason))
         del task
     print(f"align_worker {num} stopped")
 
 
-def listen_worker(in_queue, segments="./segments.txt"):
+def listen_worker(
+    in_queue,
+    segments="./segments.txt",
+    num_files=None,
+    segment_store=None,
+    manifest=None,
+    signatures=None,
+    append=False,
+):
+    """Write aligned segments and report progress.
+
+    Items of `in_queue` are ("done", name, (segments_str, record)),
+    ("failed", name, reason) or ("error", worker, reason) tuples. With
+    `segment_store`, segments are also written to a Parquet file (see
+    segment_store.py). With `manifest`, aligned files are recorded there
+    with their `signatures` (see `find_files`), once a minute and at the end.
+    With `append`, segments are added to an existing segments file, and
+    the lines written before for files aligned again are removed at the end
+    (see `drop_superseded`).
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
     print("listen_worker started.")
-    with open(segments, "w") as f:
-        for item in iter(in_queue.get, "STOP"):
-            if segments is None:
-                print(item)
+    count = {"done": 0, "failed": 0}
+    start = time.time()
+    store = None
+    if segment_store is not None:
+        store = SegmentWriter(segment_store, append=append)
+    aligned = {}  # not yet recorded in the manifest
+    last_record = start
+    done = set()
+    with open(segments, "a" if append else "w") as f:
+        offset = f.tell()  # end of the segments of earlier runs
+        for status, name, item in iter(in_queue.get, "STOP"):
+            if status == "error":
+                # a worker died, align() aborts
+                logging.error(item)
+                continue
+            count[status] += 1
+            if status == "failed":
+                logging.error(item)
             else:
-                f.write(item)
+                segments_str, record = item
+                done.add(name)
+                f.write(segments_str)
                 f.flush()
-    print("listen_worker ended.")
+                if store is not None:
+                    store.write(name, **record)
+                if manifest is not None:
+                    aligned[name] = signatures[name]
+                    if time.time() - last_record > 60:
+                        record_aligned(manifest, aligned)
+                        aligned, last_record = {}, time.time()
+            elapsed = time.time() - start
+            logging.info(
+                f"Progress: {count['done']} aligned, {count['failed']} failed"
+                f" of {num_files} files ({sum(count.values()) / elapsed:.3f} files/s)"
+            )
+    if store is not None:
+        store.close()
+    if append:
+        drop_superseded(segments, offset, done)
+    if manifest is not None:
+        record_aligned(manifest, aligned)
+    print(
+        f"listen_worker ended: {count['done']} aligned, {count['failed']} failed"
+        f" in {time.time() - start:.1f}s."
+    )
+
+
+def _scan_dir(directory, suffix, manifest=None):
+    """Recursively list files with `suffix` (or a tuple of suffixes) as a
+    stem -> [paths] index.
+
+    Directories whose mtime did not change since the cached `manifest`
+    (dirname -> {"mtime", "dirs", "files"}) are not listed again, as
+    adding, removing or renaming an entry updates the directory mtime.
+    The manifest is updated in place.
+    """
+    index = {}
+    stack = [str(directory)]
+    while stack:
+        dirname = stack.pop()
+        mtime = os.stat(dirname).st_mtime_ns
+        entry = None if manifest is None else manifest.get(dirname)
+        if entry is None or entry["mtime"] != mtime:
+            dirs, files = [], []
+            with os.scandir(dirname) as it:
+                for item in it:
+                    if item.is_dir():
+                        dirs.append(item.name)
+                    elif item.name.endswith(suffix):
+                        files.append(item.name)
+            entry = {"mtime": mtime, "dirs": dirs, "files": files}
+            if manifest is not None:
+                manifest[dirname] = entry
+        for name in entry["files"]:
+            index.setdefault(os.path.splitext(name)[0], []).append(
+                Path(dirname) / name
+            )
+        stack += [os.path.join(dirname, name) for name in entry["dirs"]]
+    return index
+
+
+def pair_signature(wav, txt):
+    """Modification time and size of both files of a pair."""
+    wav_stat, txt_stat = os.stat(wav), os.stat(txt)
+    return [
+        wav_stat.st_mtime_ns,
+        wav_stat.st_size,
+        txt_stat.st_mtime_ns,
+        txt_stat.st_size,
+    ]
+
+
+def read_manifest(manifest):
+    """Load a manifest of `find_files`, or an empty one."""
+    cache = {"wav": {}, "txt": {}, "aligned": {}}
+    if manifest is not None and Path(manifest).exists():
+        with open(manifest) as f:
+            cache.update(json.load(f))
+    return cache
+
+
+def write_manifest(manifest, cache):
+    # written to a temporary file first, so that a crash never leaves a broken manifest
+    tmp = f"{manifest}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(cache, f)
+    os.replace(tmp, manifest)
+
+
+def drop_superseded(segments, offset, names):
+    """Remove the segments of `names` written before `offset`.
+
+    Lines from `offset` on (written by this run) are kept as they are. If a
+    run is interrupted before, a file can have several blocks of segments;
+    the last block of a file is the valid one.
+    """
+    if len(names) == 0:
+        return
+    tmp = f"{segments}.tmp"
+    with open(segments, "rb") as f, open(tmp, "wb") as out:
+        while f.tell() < offset:
+            line = f.readline()
+            fields = line.split(b" ", 2)
+            if len(fields) < 2 or fields[1].decode("utf-8") not in names:
+                out.write(line)
+        shutil.copyfileobj(f, out)
+    os.replace(tmp, segments)
+
+
+def record_aligned(manifest, aligned):
+    """Add pairs (stem -> signature) that were aligned to the manifest."""
+    if len(aligned) == 0:
+        return
+    cache = read_manifest(manifest)
+    cache["aligned"].update(aligned)
+    write_manifest(manifest, cache)
 
 
-def find_files(wavdir, txtdir):
-    """Search for files in given directories."""
+def find_files(wavdir, txtdir, manifest=None):
+    """Search for files in given directories.
+
+    Both directories are listed once and matched by file stem. Audio files
+    can be wav or flac.
+    If `manifest` (a JSON file) is given, directory listings are cached there
+    and only directories changed since the last run are listed again.
+    Pairs recorded there as aligned (see `listen_worker`) are not returned
+    unless the modification time or size of one of their files changed.
+    """
+    cache = read_manifest(manifest)
+    use_cache = manifest is not None
+    wav_index = _scan_dir(wavdir, tuple(AUDIO_FORMATS), cache["wav"] if use_cache else None)
+    txt_index = _scan_dir(txtdir, ".txt", cache["txt"] if use_cache else None)
+
     files_dict = {}
-    dir_txt_list = list(txtdir.glob("**/*.txt"))
-    for wav in wavdir.glob("**/*.wav"):
-        stem = wav.stem
-        txt = None
-        for item in dir_txt_list:
-            if item.stem == stem:
-                if txt is not None:
-                    raise ValueError(f"Duplicate found: {stem}")
-                txt = item
-        if txt is None:
-            logging.error(f"No text found for {stem}.wav")
+    for stem, wavs in wav_index.items():
+        if len(wavs) > 1:
+            logging.warning(f"Duplicate found: {stem}, using {wavs[-1]}")
+        txts = txt_index.get(stem)
+        if txts is None:
+            logging.error(f"No text found for {wavs[-1]}")
+        elif len(txts) > 1:
+            raise ValueError(f"Duplicate found: {stem}")
         else:
-            files_dict[stem] = (wav, txt)
+            files_dict[stem] = (wavs[-1], txts[0])
+
+    if use_cache:
+        num_pairs = len(files_dict)
+        files_dict = {
+            stem: pair
+            for stem, pair in files_dict.items()
+            if cache["aligned"].get(stem) != pair_signature(*pair)
+        }
+        logging.info(
+            f"{num_pairs - len(files_dict)} of {num_pairs} pairs aligned before"
+            f" and unchanged."
+        )
+        write_manifest(manifest, cache)
     return files_dict
 
 
+def load_aligner(asr_train_config, asr_model_file=None, lang="ja", **kwargs):
+    """Load the CTC segmentation module and configure it for this corpus.
+
+    Text cleaners of the language's text frontend are added.
+
+    Returns:
+        aligner: CTCSegmentation object.
+        samples_to_frames_ratio: Sample points per CTC index.
+    """
+    model = {
+        "asr_train_config": asr_train_config,
+        "asr_model_file": asr_model_file,
+    }
+    logging.info(f"Loading ASR model from {asr_model_file}")
+    kwargs = {"kaldi_style_text": True, "gratis_blank": True, **kwargs}
+    aligner = CTCSegmentation(**model, **kwargs)
+    logging.info(
+        f"Zero cost transitions (gratis_blank) set to"
+        f" {aligner.config.blank_transition_cost_zero}."
+    )
+
+    # Set fixed ratio for time stamps.
+    # Note: This assumes that the Frontend discards trailing data.
+    aligner.set_config(
+        time_stamps="fixed",
+    )
+    # estimated index to frames ratio, usually 512, but sometimes 768
+    # - depends on architecture
+    samples_to_frames_ratio = int(aligner.estimate_samples_to_frames_ratio())
+    # Forced fix for some issues where the ratio is not correctly determined...
+    if 500 <= samples_to_frames_ratio <= 520:
+        samples_to_frames_ratio = 512
+    elif 750 <= samples_to_frames_ratio <= 785:
+        samples_to_frames_ratio = 768
+    aligner.set_config(
+        samples_to_frames_ratio=samples_to_frames_ratio,
+    )
+    logging.info(
+        f"Timing ratio (sample points per CTC index) set to"
+        f" {samples_to_frames_ratio} ({aligner.time_stamps})."
+    )
+
+    ## application-specific settings
+    # language specific text cleaning, e.g. jaconv for japanese
+    aligner.preprocess_fn.text_cleaner.cleaner_types += list(
+        get_frontend(lang).cleaner_types
+    )
+    return aligner, samples_to_frames_ratio
+
+
+def prepare_text(aligner, stem, txt, lang="ja"):
+    """Generate kaldi-style `text` from a txt file of download_video.py."""
+    frontend = get_frontend(lang)
+    with open(txt) as f:
+        utterance_list = f.readlines()
+    utterance_list = [
+        item.replace("\t", " ").replace("\n", "") for item in utterance_list
+    ]
+    text = []
+    for i, utt in enumerate(utterance_list):
+        utt_start, utt_end, utt_txt = utt.split(" ", 2)
+        # text processing
+        utt_txt = frontend(utt_txt)
+        cleaned = aligner.preprocess_fn.text_cleaner(utt_txt)
+        text.append(f"{stem}_{i:04} {cleaned}")
+    return text
+
+
+def read_partition(wav, start, end=None):
+    """Read samples [start:end] of an audio file as float32 without loading the rest."""
+    with soundfile.SoundFile(str(wav)) as f:
+        f.seek(start)
+        frames = -1 if end is None else end - start
+        return f.read(frames=frames, dtype="float32")
+
+
+@torch.no_grad()
+def get_lpz_batch(aligner, speeches):
+    """Obtain CTC posteriors of several audio parts in one forward pass.
+
+    Same as `aligner.get_lpz` for each part, but the parts are padded
+    to the longest one and stacked into a batch.
+
+    Args:
+        aligner: CTCSegmentation object.
+        speeches: List of 1-D audio arrays.
+    Returns:
+        List of lpz arrays, one per audio part.
+    """
+    if len(speeches) == 1:
+        return [aligner.get_lpz(speeches[0])]
+    lengths = torch.tensor([len(speech) for speech in speeches], dtype=torch.long)
+    speech = torch.nn.utils.rnn.pad_sequence(
+        [torch.as_tensor(speech) for speech in speeches], batch_first=True
+    ).to(getattr(torch, aligner.dtype))
+    batch = to_device(
+        {"speech": speech, "speech_lengths": lengths}, device=aligner.device
+    )
+    enc, enc_lengths = aligner.asr_model.encode(**batch)
+    lpz = aligner.asr_model.ctc.log_softmax(enc).detach().cpu().numpy()
+    return [lpz[i, : int(enc_lengths[i])] for i in range(len(speeches))]
+
+
+def model_fingerprint(
+    asr_train_config,
+    asr_model_file=None,
+    dtype="float32",
+    token_type=None,
+    bpemodel=None,
+    **kwargs,
+):
+    """Identify a model by what changes its CTC posteriors.
+
+    These are the config content, the model file and the inference
+    options `dtype`, `token_type` and `bpemodel`. Other options (e.g.
+    `gratis_blank`, `ngpu`) only affect segmentation and are ignored.
+    """
+    h = hashlib.sha1()
+    with open(asr_train_config, "rb") as f:
+        h.update(f.read())
+    if asr_model_file is not None:
+        stat = os.stat(asr_model_file)
+        h.update(f"{Path(asr_model_file).resolve()}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+    h.update(repr((dtype, token_type, bpemodel)).encode())
+    return h.hexdigest()
+
+
+def load_lpz(path):
+    # copy-on-write mapping: pages are read on demand, nothing is written back
+    return np.load(path, mmap_mode="c")
+
+
+class LpzCache:
+    """On-disk cache of CTC posteriors (lpz) as .npy files.
+
+    Entries are keyed by the wav content hash together with the model
+    fingerprint and the partitioning parameters, so changing text
+    normalization or CTC segmentation settings reuses them, while changing
+    the model or the partitioning does not. Segmentation tasks carry the
+    path of the entry instead of the lpz, and the alignment workers load it
+    memory-mapped, so cached lpz are not pickled through the task queue.
+    """
+
+    def __init__(self, cache_dir, model_id, **params):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.prefix = f"{model_id}:{sorted(params.items())}".encode()
+
+    def key(self, wav):
+        h = hashlib.sha1(self.prefix)
+        with open(wav, "rb") as f:
+            for chunk in iter(lambda: f.read(2**20), b""):
+                h.update(chunk)
+        return h.hexdigest()
+
+    def path(self, key):
+        return self.cache_dir / key[:2] / f"{key}.npy"
+
+    def load(self, key):
+        path = self.path(key)
+        if not path.exists():
+            return None
+        return load_lpz(path)
+
+    def save(self, key, lpz):
+        path = self.path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f"{path.stem}.{os.getpid()}.tmp.npy")
+        np.save(tmp, lpz)
+        os.replace(tmp, path)
+
+
+def infer_files(
+    aligner,
+    files,
+    task_queue,
+    done_queue,
+    samples_to_frames_ratio: int,
+    longest_audio_segments: float = 320,
+    partitions_overlap_frames: int = 30,
+    batch_size: int = 1,
+    fs: int = 16000,
+    num_files: int = None,
+    lpz_cache: Path = None,
+    model_id: str = None,
+    lang: str = "ja",
+):
+    """Infer CTC posteriors and put segmentation tasks into `task_queue`.
+
+    Partitions of consecutive files are collected into batches of
+    `batch_size` parts. A file is passed on to the alignment workers
+    as soon as all of its partitions have been inferred. Audio is read
+    partition by partition when its batch is inferred, so only the
+    partitions of the current batch are held in memory.
+
+    Args:
+        files: Iterable of (stem, (wav, txt)).
+        done_queue: Failed files are reported here as
+            ("failed", stem, reason).
+        lpz_cache: Directory of the LPZ cache. Files found there
+            skip inference, and inferred files are added.
+        model_id: Model fingerprint for the LPZ cache.
+        lang: Language code of the text frontend.
+    """
+    logging.info(
+        f"Partitioning over {longest_audio_segments}s."
+        f" Overlap time: "
+        f"{samples_to_frames_ratio/fs*(2*partitions_overlap_frames)}s"
+        f" (overlap={partitions_overlap_frames})"
+    )
+    pending = []  # (job, partition index, (start, end))
+    cache = None
+    if lpz_cache is not None:
+        cache = LpzCache(
+            lpz_cache,
+            model_id,
+            samples_to_frames_ratio=samples_to_frames_ratio,
+            longest_audio_segments=longest_audio_segments,
+            partitions_overlap_frames=partitions_overlap_frames,
+            fs=fs,
+        )
+
+    def fail(job, e):
+        # RuntimeError: unknown CUDA value error (at inference)
+        # TooShortUttError: Audio too short (at inference)
+        # IndexError: ground truth is empty (thrown at preparation)
+        if not job["failed"]:
+            reason = f"LPZ failed for file {job['stem']}; {e.__class__}: {e}"
+            done_queue.put(("failed", job["stem"], reason))
+        job["failed"] = True
+
+    def finish(job):
+        lpz = np.concatenate(job["lpzs"])
+        lpz = np.delete(lpz, job["partitions"]["delete_overlap_list"], axis=0)
+        # CAVEAT Assumption: Frontend discards trailing data:
+        expected_lpz_length = (job["speech_len"] // samples_to_frames_ratio) - 1
+        if lpz.shape[0] != expected_lpz_length and lpz.shape[0] != (
+            expected_lpz_length + 1
+        ):
+            # The one-off error fix is a little bit dirty,
+            # but it helps to deal with different frontend configurations
+            logging.error(
+                f"LPZ size mismatch on {job['stem']}: "
+                f"got {lpz.shape[0]}-{expected_lpz_length} expected."
+            )
+        # cached before the task is made, so a pair that fails there is not inferred again
+        if cache is not None:
+            cache.save(job["cache_key"], lpz)
+        task = aligner.prepare_segmentation_task(
+            job["text"], lpz, name=job["stem"], speech_len=job["speech_len"]
+        )
+        if cache is not None:
+            task.lpz = str(cache.path(job["cache_key"]))
+        # align (done by worker)
+        task_queue.put(task)
+
+    def infer(batch):
+        batch = [item for item in batch if not item[0]["failed"]]
+        if len(batch) == 0:
+            return
+        try:
+            speeches = [
+                read_partition(job["wav"], start, end) for job, _, (start, end) in batch
+            ]
+            lpzs = get_lpz_batch(aligner, speeches)
+            del speeches
+        except Exception as e:
+            if len(batch) == 1:
+                fail(batch[0][0], e)
+                return
+            # find the failing file part by part
+            logging.warning(f"Batched inference failed ({e}), retrying part by part.")
+            for item in batch:
+                infer([item])
+            return
+        for (job, i, _), lpz in zip(batch, lpzs):
+            job["lpzs"][i] = lpz
+            job["remaining"] -= 1
+            if job["remaining"] == 0:
+                try:
+                    finish(job)
+                except Exception as e:
+                    fail(job, e)
+
+    count_files = 0
+    for stem, (wav, txt) in files:
+        count_files += 1
+        try:
+            # generate kaldi-style `text`
+            text = prepare_text(aligner, stem, txt, lang)
+
+            # cached lpz: no inference needed
+            cache_key = None
+            if cache is not None:
+                cache_key = cache.key(wav)
+                lpz = cache.load(cache_key)
+                if lpz is not None:
+                    logging.info(f"Loaded cached LPZ of file {stem}.")
+                    task = aligner.prepare_segmentation_task(
+                        text, lpz, name=stem, speech_len=soundfile.info(str(wav)).frames
+                    )
+                    task.lpz = str(cache.path(cache_key))
+                    task_queue.put(task)
+                    continue
+
+            # audio (read later, per partition)
+            info = soundfile.info(str(wav))
+            speech_len, sample_rate = info.frames, info.samplerate
+            partitions = get_partitions(
+                speech_len,
+                max_len_s=longest_audio_segments,
+                samples_to_frames_ratio=samples_to_frames_ratio,
+                fs=fs,
+                overlap=partitions_overlap_frames,
+            )
+        except Exception as e:
+            reason = f"LPZ failed for file {stem}; {e.__class__}: {e}"
+            done_queue.put(("failed", stem, reason))
+            continue
+        duration = speech_len / sample_rate
+
+        logging.info(
+            f"Inference on file {stem} {count_files}/{num_files}: {len(text)}"
+            f" utterances:  ({duration}s ~{len(partitions['partitions'])}p)"
+        )
+        job = {
+            "stem": stem,
+            "wav": wav,
+            "text": text,
+            "speech_len": speech_len,
+            "partitions": partitions,
+            "lpzs": [None] * len(partitions["partitions"]),
+            "remaining": len(partitions["partitions"]),
+            "failed": False,
+            "cache_key": cache_key,
+        }
+        for i, (start, end) in enumerate(partitions["partitions"]):
+            pending.append((job, i, (start, end)))
+        while len(pending) >= batch_size:
+            infer(pending[:batch_size])
+            pending = pending[batch_size:]
+    while len(pending) > 0:
+        infer(pending[:batch_size])
+        pending = pending[batch_size:]
+
+
+def inference_worker(
+    file_queue, task_queue, done_queue, model, infer_kwargs, num=0, num_threads=1
+):
+    """Load an own copy of the ASR model and infer files from `file_queue`.
+
+    Exceptions (e.g. a bad config or CUDA OOM) are reported to `done_queue`
+    and end the process with a non-zero exit code, see `WorkerError`.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    print(f"inference_worker {num} started")
+    torch.set_num_threads(num_threads)
+    try:
+        aligner, samples_to_frames_ratio = load_aligner(
+            lang=infer_kwargs["lang"], **model
+        )
+        infer_files(
+            aligner,
+            iter(file_queue.get, "STOP"),
+            task_queue,
+            done_queue,
+            samples_to_frames_ratio,
+            **infer_kwargs,
+        )
+    except Exception as e:
+        reason = f"inference_worker {num} died; {e.__class__}: {e}"
+        done_queue.put(("error", f"inference_worker {num}", reason))
+        raise
+    print(f"inference_worker {num} stopped")
+
+
+def drain(queue):
+    """Remove all items from `queue` without blocking."""
+    try:
+        while True:
+            queue.get_nowait()
+    except Empty:
+        pass
+
+
+class WorkerError(RuntimeError):
+    """A worker process died, so its queue may never be read again."""
+
+
+def check_workers(workers):
+    """Raise `WorkerError` if one of `workers` exited with an error."""
+    for worker in workers:
+        if worker.exitcode not in (None, 0):
+            raise WorkerError(
+                f"{worker.name} exited with code {worker.exitcode}"
+                f" (see segments.log)."
+            )
+
+
+def put_checked(queue, item, workers, timeout: float = 1.0):
+    """Put `item` into a bounded `queue` read by `workers`.
+
+    Instead of blocking forever, `WorkerError` is raised if one of the
+    workers died.
+    """
+    while True:
+        check_workers(workers)
+        try:
+            queue.put(item, timeout=timeout)
+            return
+        except Full:
+            pass
+
+
 def align(
     wavdir: Path,
     txtdir: Path,
@@ -219,6 +783,13 @@ def align(
     longest_audio_segments: float = 320,
     partitions_overlap_frames: int = 30,
     log_level: Union[int, str] = "INFO",
+    manifest: Path = None,
+    batch_size: int = 1,
+    inference_workers: int = 0,
+    num_workers: int = NUMBER_OF_PROCESSES,
+    lpz_cache: Path = None,
+    lang: str = "ja",
+    segment_store: bool = False,
     **kwargs,
 ):
     """Provide the scripting interface to score text to audio.
@@ -236,6 +807,45 @@ def align(
         in lpz indices. The time is calculated as:
         overlap_time [s] = frontend_frame_size / fs * OVERLAP
         Should be > 600 ms.
+
+    manifest:
+        JSON file caching the listings of wavdir and txtdir and the pairs
+        aligned so far. Repeated runs only list directories that changed
+        and only align new or changed pairs; their segments are appended to
+        the segments file. Use one manifest per output directory.
+
+    batch_size:
+        Number of audio partitions (of one or several files) that are
+        padded and inferred in one forward pass.
+
+    inference_workers:
+        Number of processes for inference, each with its own copy of the
+        model. With 0, inference runs in the main process.
+
+    num_workers:
+        Number of CTC segmentation processes.
+
+    lpz_cache:
+        Directory to cache CTC posteriors in. Re-running with other text
+        normalization or segmentation settings then skips inference.
+
+    lang:
+        Language code of the subtitles. Selects the text frontend
+        (see text_frontend.py); the ASR model must match the language.
+
+    segment_store:
+        Also write the segments to `segments.parquet`, a directory of
+        Parquet parts with per-file indexes (see segment_store.py). Parts
+        are written as alignment goes on, so they survive a crash.
+        Requires pyarrow.
+
+    If an inference worker dies, files not started yet are dropped, files
+    already inferred are still aligned and written, and `WorkerError` is
+    raised.
+
+    On KeyboardInterrupt, files waiting for inference are dropped, but files
+    being inferred or already inferred are still aligned and written before
+    the workers are stopped.
     """
     assert check_argument_types()
     # make sure that output is a path!
@@ -254,144 +864,128 @@ def align(
     model = {
         "asr_train_config": asr_train_config,
         "asr_model_file": asr_model_file,
+        **kwargs,
     }
-    logging.info(f"Loading ASR model from {asr_model_file}")
-    aligner = CTCSegmentation(
-        **model, **kwargs, kaldi_style_text=True, gratis_blank=True
-    )
     fs = 16000
-    logging.info(
-        f"Zero cost transitions (gratis_blank) set to"
-        f" {aligner.config.blank_transition_cost_zero}."
-    )
-
-    # Set fixed ratio for time stamps.
-    # Note: This assumes that the Frontend discards trailing data.
-    aligner.set_config(
-        time_stamps="fixed",
-    )
-    # estimated index to frames ratio, usually 512, but sometimes 768
-    # - depends on architecture
-    samples_to_frames_ratio = int(aligner.estimate_samples_to_frames_ratio())
-    # Forced fix for some issues where the ratio is not correctly determined...
-    if 500 <= samples_to_frames_ratio <= 520:
-        samples_to_frames_ratio = 512
-    elif 750 <= samples_to_frames_ratio <= 785:
-        samples_to_frames_ratio = 768
-    aligner.set_config(
-        samples_to_frames_ratio=samples_to_frames_ratio,
-    )
-    logging.info(
-        f"Timing ratio (sample points per CTC index) set to"
-        f" {samples_to_frames_ratio} ({aligner.time_stamps})."
-    )
-    logging.info(
-        f"Partitioning over {longest_audio_segments}s."
-        f" Overlap time: "
-        f"{samples_to_frames_ratio/fs*(2*partitions_overlap_frames)}s"
-        f" (overlap={partitions_overlap_frames})"
-    )
-
-    ## application-specific settings
-    # japanese text cleaning
-    aligner.preprocess_fn.text_cleaner.cleaner_types += ["jaconv"]
+    if inference_workers == 0:
+        aligner, samples_to_frames_ratio = load_aligner(lang=lang, **model)
 
     # Create queues
-    task_queue = Queue(maxsize=NUMBER_OF_PROCESSES)
+    task_queue = Queue(maxsize=num_workers)
     done_queue = Queue()
 
     # find files
-    files_dict = find_files(wavdir, txtdir)
+    append = manifest is not None and len(read_manifest(manifest)["aligned"]) > 0
+    files_dict = find_files(wavdir, txtdir, manifest)
     num_files = len(files_dict)
     logging.info(f"Found {num_files} files.")
+    signatures = None
+    if manifest is not None:
+        signatures = {stem: pair_signature(*pair) for stem, pair in files_dict.items()}
 
     # Start worker processes
-    Process(
+    listener = Process(
         target=listen_worker,
         args=(
             done_queue,
             segments,
+            num_files,
+            output / "segments.parquet" if segment_store else None,
+            manifest,
+            signatures,
+            append,
         ),
-    ).start()
-    for i in range(NUMBER_OF_PROCESSES):
-        Process(target=align_worker, args=(task_queue, done_queue, i)).start()
-
-    # Align
-    count_files = 0
-    for stem in files_dict.keys():
-        count_files += 1
-        (wav, txt) = files_dict[stem]
-
-        # generate kaldi-style `text`
-        with open(txt) as f:
-            utterance_list = f.readlines()
-        utterance_list = [
-            item.replace("\t", " ").replace("\n", "") for item in utterance_list
-        ]
-        text = []
-        for i, utt in enumerate(utterance_list):
-            utt_start, utt_end, utt_txt = utt.split(" ", 2)
-            # text processing
-            utt_txt = text_processing(utt_txt)
-            cleaned = aligner.preprocess_fn.text_cleaner(utt_txt)
-            text.append(f"{stem}_{i:04} {cleaned}")
-
-        # audio
-        speech, sample_rate = soundfile.read(wav)
-        speech_len = speech.shape[0]
-        speech = torch.tensor(speech)
-        partitions = get_partitions(
-            speech_len,
-            max_len_s=longest_audio_segments,
-            samples_to_frames_ratio=samples_to_frames_ratio,
-            fs=fs,
-            overlap=partitions_overlap_frames,
-        )
-        duration = speech_len / sample_rate
-        # CAVEAT Assumption: Frontend discards trailing data:
-        expected_lpz_length = (speech_len // samples_to_frames_ratio) - 1
+    )
+    listener.start()
+    align_workers = [
+        Process(target=align_worker, args=(task_queue, done_queue, i))
+        for i in range(num_workers)
+    ]
+    for worker in align_workers:
+        worker.start()
 
-        logging.info(
-            f"Inference on file {stem} {count_files}/{num_files}: {len(utterance_list)}"
-            f" utterances:  ({duration}s ~{len(partitions['partitions'])}p)"
-        )
-        try:
-            # infer
-            lpzs = [
-                torch.tensor(aligner.get_lpz(speech[start:end]))
-                for start, end in partitions["partitions"]
-            ]
-            lpz = torch.cat(lpzs).numpy()
-            lpz = np.delete(lpz, partitions["delete_overlap_list"], axis=0)
-            if lpz.shape[0] != expected_lpz_length and lpz.shape[0] != (
-                expected_lpz_length + 1
-            ):
-                # The one-off error fix is a little bit dirty,
-                # but it helps to deal with different frontend configurations
-                logging.error(
-                    f"LPZ size mismatch on {stem}: "
-                    f"got {lpz.shape[0]}-{expected_lpz_length} expected."
+    # Infer (done here or by inference workers), then align (done by workers)
+    infer_kwargs = {
+        "longest_audio_segments": longest_audio_segments,
+        "partitions_overlap_frames": partitions_overlap_frames,
+        "batch_size": batch_size,
+        "fs": fs,
+        "num_files": num_files,
+        "lpz_cache": lpz_cache,
+        "model_id": None if lpz_cache is None else model_fingerprint(**model),
+        "lang": lang,
+    }
+    inference_workers_list = []
+    error = None
+    interrupted = False
+    try:
+        if inference_workers > 0:
+            file_queue = Queue(maxsize=2 * inference_workers)
+            inference_workers_list = [
+                Process(
+                    target=inference_worker,
+                    args=(
+                        file_queue,
+                        task_queue,
+                        done_queue,
+                        model,
+                        infer_kwargs,
+                        i,
+                        max(1, torch.get_num_threads() // inference_workers),
+                    ),
                 )
-            task = aligner.prepare_segmentation_task(
-                text, lpz, name=stem, speech_len=speech_len
+                for i in range(inference_workers)
+            ]
+            for worker in inference_workers_list:
+                worker.start()
+            for item in files_dict.items():
+                put_checked(file_queue, item, inference_workers_list)
+        else:
+            infer_files(
+                aligner,
+                files_dict.items(),
+                task_queue,
+                done_queue,
+                samples_to_frames_ratio,
+                **infer_kwargs,
             )
-            # align (done by worker)
-            task_queue.put(task)
-        except KeyboardInterrupt:
-            print(" -- Received keyboard interrupt. Stopping.")
-            break
-        except Exception as e:
-            # RuntimeError: unknown CUDA value error (at inference)
-            # TooShortUttError: Audio too short (at inference)
-            # IndexError: ground truth is empty (thrown at preparation)
-            logging.error(f"LPZ failed for file {stem}; {e.__class__}: {e}")
+    except KeyboardInterrupt:
+        print(" -- Received keyboard interrupt. Stopping after files being inferred.")
+        interrupted = True
+    except WorkerError as e:
+        error = e
     logging.info("Shutting down workers.")
-    # wait for workers to finish
-    time.sleep(20)
-    # Tell child processes to stop
-    for i in range(NUMBER_OF_PROCESSES):
+    # Tell child processes to stop once their queues are drained
+    if error is None and not interrupted:
+        try:
+            for worker in inference_workers_list:
+                put_checked(file_queue, "STOP", inference_workers_list)
+        except WorkerError as e:
+            error = e
+    if error is not None:
+        logging.error(f"{error} Aborting.")
+    if (error is not None or interrupted) and len(inference_workers_list) > 0:
+        # files not started yet are dropped, the remaining workers finish theirs
+        drain(file_queue)
+        for worker in inference_workers_list:
+            if worker.is_alive():
+                file_queue.put("STOP")
+    for worker in inference_workers_list:
+        worker.join()
+    if error is None:
+        try:
+            check_workers(inference_workers_list)
+        except WorkerError as e:
+            error = e
+            logging.error(f"{error} Files it was inferring are missing.")
+    for worker in align_workers:
         task_queue.put("STOP")
+    for worker in align_workers:
+        worker.join()
     done_queue.put("STOP")
+    listener.join()
+    if error is not None:
+        raise error
 
 
 def get_parser():
@@ -441,6 +1035,14 @@ def get_parser():
         "If not given, refers from the training args",
     )
 
+    group.add_argument(
+        "--lang",
+        type=str,
+        default="ja",
+        help="Language code of the subtitles (ja, en, ...)."
+        " Selects the text normalization; see text_frontend.py.",
+    )
+
     group = parser.add_argument_group("CTC segmentation related")
     group.add_argument(
         "--fs",
@@ -459,6 +1061,26 @@ def get_parser():
         " if there are unrelated audio segments between utterances.",
     )
 
+    group.add_argument(
+        "--batch_size",
+        type=int,
+        default=1,
+        help="Number of audio partitions inferred in one forward pass."
+        " Partitions of several files are padded and stacked into a batch.",
+    )
+    group.add_argument(
+        "--inference_workers",
+        type=int,
+        default=0,
+        help="Number of inference processes, each with its own copy of the"
+        " model. With 0, inference runs in the main process.",
+    )
+    group.add_argument(
+        "--num_workers",
+        type=int,
+        default=NUMBER_OF_PROCESSES,
+        help="Number of CTC segmentation processes.",
+    )
     group.add_argument(
         "--longest_audio_segments",
         type=int,
@@ -477,7 +1099,7 @@ def get_parser():
         "--wavdir",
         type=Path,
         required=True,
-        help="WAV folder.",
+        help="WAV (or FLAC) folder.",
     )
     group.add_argument(
         "--txtdir",
@@ -490,6 +1112,26 @@ def get_parser():
         type=Path,
         help="Output segments directory.",
     )
+    group.add_argument(
+        "--segment_store",
+        type=str2bool,
+        default=False,
+        help="Also write segments to segments.parquet, indexed by file.",
+    )
+    group.add_argument(
+        "--lpz_cache",
+        type=Path,
+        default=None,
+        help="Directory to cache CTC posteriors (lpz) in.",
+    )
+    group.add_argument(
+        "--manifest",
+        type=Path,
+        default=None,
+        help="JSON file to cache the file lists of wavdir and txtdir and the"
+        " pairs aligned so far. Only new or changed pairs are aligned, and their"
+        " segments are appended to the output.",
+    )
     return parser
 
 
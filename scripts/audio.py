@@ -0,0 +1,143 @@
+import subprocess
+from math import gcd
+from pathlib import Path
+import numpy as np
+import soundfile as sf
+from scipy.signal import firwin, resample_poly
+
+PCM_SUBTYPES = ["PCM_16", "PCM_24", "PCM_32"]
+# output formats of the 16kHz audio by file extension; FLAC is lossless and about half the size, and
+# soundfile decodes only the frames around a seek position, so partitions can still be read on demand
+AUDIO_FORMATS = {".wav": "WAV", ".flac": "FLAC"}
+
+
+def output_subtype(fn_out, subtype: str) -> str:
+  # keep the sample format of the input if the output format supports it (FLAC: up to 24 bit)
+  fmt = AUDIO_FORMATS.get(Path(fn_out).suffix.lower(), "WAV")
+  return subtype if subtype in PCM_SUBTYPES and sf.check_format(fmt, subtype) else "PCM_16"
+
+
+def find_peak(f: sf.SoundFile, blocksize: int = 2**18) -> float:
+  # 1st pass: peak amplitude over all channels
+  peak = 0.0
+  f.seek(0)
+  for block in f.blocks(blocksize, dtype="float32", always_2d=True):
+    if len(block) > 0:
+      peak = max(peak, float(block.max()), -float(block.min()))
+  return peak
+
+
+def normalize_resample(fn_in, fn_out, fs: int = 16000, headroom: float = 5.0, blocksize: int = 2**18):
+  """Peak-normalize, resample to `fs` and mix down to 1ch, block by block.
+
+  Same processing as pydub.effects.normalize(wav, headroom).set_frame_rate(fs).set_channels(1),
+  but the file is never loaded at once: the 1st pass finds the peak, the 2nd pass resamples
+  blocks of `blocksize` samples with a polyphase filter. Each block is read with enough context
+  on both sides that the result equals resampling the whole signal, so peak memory does not
+  depend on the file length.
+  """
+  with sf.SoundFile(str(fn_in)) as f:
+    peak = find_peak(f, blocksize)
+    gain = 10 ** (-headroom / 20) / peak if peak > 0 else 1.0
+    subtype = output_subtype(fn_out, f.subtype)
+
+    g = gcd(fs, f.samplerate)
+    up, down = fs // g, f.samplerate // g
+    # blocks start at multiples of `down`, so that output samples of each block are on the same grid as the whole signal
+    block = max(down, blocksize - blocksize % down)
+    # same filter as resample_poly's default, designed once for all blocks
+    half_len = 10 * max(up, down) if up != down else 0
+    h = firwin(2 * half_len + 1, 1.0 / max(up, down), window=("kaiser", 5.0)).astype(np.float32) if up != down else None
+    context = -(-half_len // up) + 1 # half length of the filter in input samples
+    context += -context % down
+    # gain and mix-down as one matrix-vector product
+    mix = np.full(f.channels, gain / f.channels, dtype=np.float32)
+
+    with sf.SoundFile(str(fn_out), "w", samplerate=fs, channels=1, subtype=subtype) as fo:
+      for start in range(0, f.frames, block):
+        n = min(block, f.frames - start)
+        left = min(context, start)
+        right = min(context, f.frames - start - n)
+
+        f.seek(start - left)
+        x = f.read(left + n + right, dtype="float32", always_2d=True) @ mix
+        y = resample_poly(x, up, down, window=h) if up != down else x
+
+        offset = left * up // down
+        length = -(-(start + n) * up // down) - start * up // down
+        y = np.clip(y[offset:offset + length], -1.0, 1.0)
+        # quantized here (as int16 / 32768 is read back), since libsndfile scales floats differently for WAV and FLAC
+        fo.write(np.clip(np.round(y * 32768), -32768, 32767).astype(np.int16) if subtype == "PCM_16" else y)
+
+  return Path(fn_out)
+
+
+def apply_gain(fn, gain: float, blocksize: int = 2**18):
+  """Multiply the samples of an audio file by `gain` in place, block by block."""
+  with sf.SoundFile(str(fn), "r+") as f:
+    for start in range(0, f.frames, blocksize):
+      f.seek(start)
+      x = f.read(blocksize, dtype="float32", always_2d=True)
+      f.seek(start)
+      f.write(np.clip(x * gain, -1.0, 1.0))
+
+
+def decode_normalize(url, fn_out, fs: int = 16000, headroom: float = 5.0, http_headers: dict = None,
+    blocksize: int = 2**18, timeout: float = 30.0):
+  """Decode an audio stream (URL or file) with ffmpeg to `fs` Hz, 1ch PCM_16 and peak-normalize it.
+  `fn_out` is written as WAV or FLAC by its extension.
+
+  ffmpeg fetches, decodes and resamples in one pass (to 2ch, so that the peak is taken before the
+  mix-down as in normalize_resample()). Its output is mixed down and written to `fn_out` while the
+  peak is tracked, so no full-rate file is written. The gain is then applied in place, i.e., unlike
+  normalize_resample(), the samples are quantized twice (before and after the gain).
+  A stream that stalls for `timeout` seconds fails.
+  """
+  cmd = ["ffmpeg", "-nostdin", "-loglevel", "error"]
+  if str(url).startswith(("http://", "https://")):
+    cmd += ["-rw_timeout", str(int(timeout * 1e6))]
+    if http_headers:
+      cmd += ["-headers", "".join(f"{k}: {v}\r\n" for k, v in http_headers.items())]
+  cmd += ["-i", url, "-vn", "-ac", "2", "-ar", str(fs), "-f", "s16le", "-"]
+  mix = np.full(2, 0.5 / 32768, dtype=np.float32)
+
+  # written to {fn_out}.part first, so an interrupted download never leaves a complete-looking file
+  fn_out = Path(fn_out)
+  fmt = AUDIO_FORMATS.get(fn_out.suffix.lower(), "WAV")
+  fn_part = fn_out.with_name(fn_out.name + ".part")
+  # FLAC files cannot be modified in place: the normalized wav is encoded to FLAC afterwards
+  fn_wav = fn_part if fmt == "WAV" else fn_out.with_name(fn_out.stem + ".wav.part")
+  peak = 0
+  try:
+    with subprocess.Popen(cmd, stdout=subprocess.PIPE) as p, \
+        sf.SoundFile(str(fn_wav), "w", samplerate=fs, channels=1, subtype="PCM_16", format="WAV") as f:
+      # a read can end within a frame (2ch x 2 bytes); the rest is carried to the next read
+      carry = b""
+      for data in iter(lambda: p.stdout.read(4 * blocksize), b""):
+        if carry:
+          data = carry + data
+        n = len(data) - len(data) % 4
+        carry = data[n:]
+        x = np.frombuffer(data, dtype="<i2", count=n // 2).reshape(-1, 2)
+        if len(x) > 0:
+          peak = max(peak, int(x.max()), -int(x.min()))
+          f.write(x @ mix)
+    if p.returncode != 0:
+      raise RuntimeError(f"ffmpeg exited with {p.returncode}")
+
+    # same gain as normalize_resample(): the peak is read as float (int16 / 32768)
+    peak = peak / 32768
+    if peak > 0:
+      apply_gain(fn_wav, 10 ** (-headroom / 20) / peak, blocksize)
+
+    if fmt != "WAV":
+      with sf.SoundFile(str(fn_wav)) as f, \
+          sf.SoundFile(str(fn_part), "w", samplerate=fs, channels=1, subtype="PCM_16", format=fmt) as fo:
+        for block in f.blocks(blocksize, dtype="int16"):
+          fo.write(block)
+    fn_part.rename(fn_out)
+  finally:
+    # part files of failed or interrupted decodes
+    fn_wav.unlink(missing_ok=True)
+    fn_part.unlink(missing_ok=True)
+  return fn_out
@@ -0,0 +1,133 @@
+import time
+import argparse
+import sys
+import tempfile
+import tracemalloc
+from pathlib import Path
+import numpy as np
+
+
+def parse_args():
+  parser = argparse.ArgumentParser(
+    description="Micro-benchmarks of the processing steps.",
+    formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+  )
+  subparsers = parser.add_subparsers(dest="target", required=True)
+
+  p = subparsers.add_parser("resample", help="normalization and resampling of downloaded audio")
+  p.add_argument("--wav",     type=str, default=None, help="filename of wav file (default: synthetic audio)")
+  p.add_argument("--minutes", type=float, default=10.0, help="length of synthetic audio")
+
+  p = subparsers.add_parser("vtt", help="conversion of subtitles (vtt -> txt)")
+  p.add_argument("--vttdir",  type=str, default=None, help="dirname of vtt files (default: synthetic subtitles)")
+  p.add_argument("--auto",    action="store_true", default=False, help="parse automatic subtitles")
+  p.add_argument("--cues",    type=int, default=100000, help="number of cues of synthetic subtitles")
+
+  p = subparsers.add_parser("text", help="text normalization for the aligner")
+  p.add_argument("--txtdir",  type=str, default=None, help="dirname of txt files (default: synthetic utterances)")
+  p.add_argument("--lang",    type=str, default="ja", help="language code of the text frontend")
+  p.add_argument("--workers", type=int, default=None, help="number of processes for batch normalization")
+  return parser.parse_args(sys.argv[1:])
+
+
+def measure(func, *args, **kwargs):
+  # wall time, then peak of traced memory allocations in a 2nd run (tracing slows down python code)
+  start = time.perf_counter()
+  func(*args, **kwargs)
+  elapsed = time.perf_counter() - start
+
+  tracemalloc.start()
+  func(*args, **kwargs)
+  peak = tracemalloc.get_traced_memory()[1]
+  tracemalloc.stop()
+  return elapsed, peak
+
+
+def print_result(name, elapsed, peak, n, unit):
+  print(f"{name:>12}: {elapsed:8.3f} s, {n / elapsed:12.1f} {unit}/s, peak memory {peak / 2**20:8.1f} MiB")
+
+
+def benchmark_resample(fn_wav=None, minutes=10.0):
+  import soundfile as sf
+  from audio import normalize_resample
+
+  with tempfile.TemporaryDirectory() as tmpdir:
+    if fn_wav is None:
+      fn_wav = Path(tmpdir) / "org.wav"
+      sr = 48000
+      x = 0.1 * np.random.randn(int(minutes * 60 * sr), 2)
+      sf.write(fn_wav, x, sr, subtype="PCM_16")
+    duration = sf.info(str(fn_wav)).duration
+
+    def run_pydub():
+      import pydub
+      wav = pydub.AudioSegment.from_file(fn_wav, format = "wav")
+      wav = pydub.effects.normalize(wav, 5.0).set_frame_rate(16000).set_channels(1)
+      wav.export(Path(tmpdir) / "pydub.wav", format="wav", bitrate="16k")
+
+    try:
+      print_result("pydub", *measure(run_pydub), duration, "audio-sec")
+    except ImportError:
+      print("pydub is not available.")
+    print_result("streaming", *measure(normalize_resample, fn_wav, Path(tmpdir) / "stream.wav"), duration, "audio-sec")
+
+
+def make_vtt(n_cue, auto=False):
+  # synthetic subtitle in the format of YouTube
+  ts = lambda t: f"{int(t // 3600):02d}:{int(t // 60 % 60):02d}:{t % 60:06.3f}"
+  vtt = ["WEBVTT\n", "Kind: captions\n", "Language: ja\n", "\n"]
+  for i in range(n_cue):
+    t = 2.5 * i
+    if auto:
+      vtt += [f"{ts(t)} --> {ts(t + 2.5)} align:start position:0%\n", " \n",
+        f"こんにちは<{ts(t + 0.5)}><c> 世界</c><{ts(t + 1.0)}><c> 123</c>\n", "\n"]
+    else:
+      vtt += [f"{ts(t)} --> {ts(t + 2.5)}\n", "» こんにちは　世界 «\n", "テスト 123\n", "\n"]
+  return vtt
+
+
+def benchmark_vtt(vttdir=None, auto=False, n_cue=100000):
+  from util import vtt2txt, autovtt2txt
+  convert = autovtt2txt if auto else vtt2txt
+
+  if vttdir is None:
+    vtts = [make_vtt(n_cue, auto)]
+  else:
+    vtts = [open(fn, "r").readlines() for fn in sorted(Path(vttdir).glob("**/*.vtt"))]
+  n_line = sum(len(vtt) for vtt in vtts)
+
+  elapsed, peak = measure(lambda: [convert(vtt) for vtt in vtts])
+  print(f"{len(vtts)} files, {n_line} lines")
+  print_result(convert.__name__, elapsed, peak, n_line, "lines")
+
+
+def benchmark_text(txtdir=None, lang="ja", workers=None):
+  import text_frontend
+
+  if txtdir is None:
+    # subtitles repeat a lot (jingles, credits, numbers)
+    texts = [f"\"第{i % 500}回　ＡＢＣ　ニュース {i % 37}.5%\"" for i in range(50000)]
+  else:
+    texts = [line.replace("\t", " ").rstrip("\n").split(" ", 2)[2]
+      for fn in sorted(Path(txtdir).glob("**/*.txt")) for line in open(fn, "r")]
+  print(f"{len(texts)} utterances, {len(set(texts))} unique")
+  frontend = text_frontend.get_frontend(lang)
+
+  def run_cached():
+    frontend.cache_clear()
+    [frontend(t) for t in texts]
+
+  print_result("uncached", *measure(lambda: [frontend._normalize(t) for t in texts]), len(texts), "utts")
+  print_result("cached", *measure(run_cached), len(texts), "utts")
+  print_result("batch", *measure(text_frontend.normalize_batch, texts, lang, workers), len(texts), "utts")
+
+
+if __name__ == "__main__":
+  args = parse_args()
+
+  if args.target == "resample":
+    benchmark_resample(args.wav, args.minutes)
+  elif args.target == "vtt":
+    benchmark_vtt(args.vttdir, args.auto, args.cues)
+  elif args.target == "text":
+    benchmark_text(args.txtdir, args.lang, args.workers)
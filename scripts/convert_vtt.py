@@ -0,0 +1,71 @@
+import os
+import time
+import argparse
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from util import vtt2txt, autovtt2txt, write_txt
+from tqdm import tqdm
+
+def parse_args():
+  parser = argparse.ArgumentParser(
+    description="Converting downloaded subtitles (vtt) to txt files.",
+    formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+  )
+  parser.add_argument("lang",      type=str, help="language code (ja, en, ...)")
+  parser.add_argument("--outdir",  type=str, default="video", help="dirname of downloaded videos")
+  parser.add_argument("--vtt",     type=str, default="vtt", help="dirname of subtitles (under {outdir}/{lang})")
+  parser.add_argument("--txt",     type=str, default="txt", help="dirname to save txt files (under {outdir}/{lang})")
+  parser.add_argument("--auto",    action='store_true', default=False, help="subtitles are automatic subtitles.")
+  parser.add_argument("--force",   action='store_true', default=False, help="convert files whose txt file is up to date.")
+  parser.add_argument("--workers", type=int, default=os.cpu_count(), help="number of processes")
+  return parser.parse_args(sys.argv[1:])
+
+
+def convert_file(fn_vtt, fn_txt, auto=False):
+  try:
+    with open(fn_vtt, "r") as f:
+      txt = autovtt2txt(f) if auto else vtt2txt(f)
+    fn_txt.parent.mkdir(parents=True, exist_ok=True)
+    write_txt(fn_txt, txt)
+  except Exception as e:
+    print(f"Falied to convert subtitle file to txt file: filename = {fn_vtt}, error = {e}")
+    return False
+  return True
+
+
+def convert_vtt(lang, outdir="video", vtt="vtt", txt="txt", auto=False, force=False, workers=1):
+  """
+  Tips:
+    Converts {outdir}/{lang}/{vtt}/**/*.vtt to {outdir}/{lang}/{txt}/**/*.txt, e.g. after changing the parser
+    or to use automatic subtitles (auto=True) without downloading them again.
+    Files whose txt file is newer than the vtt file are skipped unless force=True.
+  """
+  dir_vtt = Path(outdir) / lang / vtt
+  dir_txt = Path(outdir) / lang / txt
+
+  # find files to be converted
+  files = []
+  for fn_vtt in dir_vtt.glob("**/*.vtt"):
+    fn_txt = dir_txt / fn_vtt.relative_to(dir_vtt).with_suffix(".txt")
+    if force or not fn_txt.exists() or fn_txt.stat().st_mtime < fn_vtt.stat().st_mtime:
+      files.append((fn_vtt, fn_txt))
+
+  # convert in parallel
+  start = time.perf_counter()
+  n_file = 0
+  with ProcessPoolExecutor(max_workers=workers) as executor:
+    results = executor.map(convert_file, *zip(*files), [auto] * len(files), chunksize=64) if len(files) > 0 else []
+    for ok in tqdm(results, total=len(files)):
+      n_file += int(ok)
+  elapsed = time.perf_counter() - start
+
+  print(f"converted {n_file}/{len(files)} files in {elapsed:.1f} s ({n_file / max(elapsed, 1e-9):.1f} files/s).")
+  return dir_txt
+
+
+if __name__ == "__main__":
+  args = parse_args()
+
+  dirname = convert_vtt(args.lang, args.outdir, args.vtt, args.txt, args.auto, args.force, args.workers)
+  print(f"save {args.lang.upper()} txt files to {dirname}.")
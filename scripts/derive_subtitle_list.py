@@ -0,0 +1,52 @@
+import argparse
+import csv
+import sys
+from pathlib import Path
+from util import MetadataStore
+
+def parse_args():
+  parser = argparse.ArgumentParser(
+    description="Deriving subtitle lists of languages from the metadata store (without probing again).",
+    formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+  )
+  parser.add_argument("lang",          type=str, nargs="+", help="language codes (ja, en, ...), or \"all\" for all languages in the store")
+  parser.add_argument("--metadata",    type=str, default="metadata.sqlite", help="filename of metadata store")
+  parser.add_argument("--videoidlist", type=str, default=None, help="filename of video ID list (default: all probed videos with a subtitle in the language)")
+  parser.add_argument("--outdir",      type=str, default="sub", help="dirname to save results")
+  return parser.parse_args(sys.argv[1:])
+
+
+def derive_subtitle_list(lang, fn_metadata="metadata.sqlite", fn_videoid=None, outdir="sub", store=None):
+  """
+  Tips:
+    Writes {outdir}/{lang}/{stem}.csv (videoid, auto, sub, channelid; same columns as data/{lang}/*.csv), where
+    {stem} is the stem of `fn_videoid`, or "metadata" without it. With `fn_videoid`, all videos of the list found
+    in the store are written in the order of the list, like retrieve_subtitle_exists.py; videos not probed yet
+    are skipped. Without it, all probed videos with an automatic or manual subtitle in `lang` are written.
+  """
+  store = store or MetadataStore(fn_metadata)
+  stem = Path(fn_videoid).stem if fn_videoid is not None else "metadata"
+  fn_sub = Path(outdir) / lang / f"{stem}.csv"
+  fn_sub.parent.mkdir(parents=True, exist_ok=True)
+
+  videoids = None
+  if fn_videoid is not None:
+    videoids = (v.strip(" ").strip("\n") for v in open(fn_videoid))
+    videoids = (v for v in videoids if len(v) > 0)
+
+  with open(fn_sub, "w", newline="") as f:
+    writer = csv.DictWriter(f, fieldnames=["videoid", "auto", "sub", "channelid"])
+    writer.writeheader()
+    writer.writerows(store.query(lang, videoids))
+  return fn_sub
+
+
+if __name__ == "__main__":
+  args = parse_args()
+
+  store = MetadataStore(args.metadata)
+  langs = store.languages() if args.lang == ["all"] else args.lang
+  for lang in langs:
+    filename = derive_subtitle_list(lang, fn_videoid=args.videoidlist, outdir=args.outdir, store=store)
+    print(f"save {lang.upper()} subtitle info to {filename}.")
+  store.close()
@@ -1,12 +1,13 @@
-import time
 import argparse
 import sys
-import subprocess
 import shutil
-import pydub
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
-from util import make_video_url, make_basename, vtt2txt, autovtt2txt
-import pandas as pd
+from audio import AUDIO_FORMATS, normalize_resample, decode_normalize
+from util import make_video_url, make_basename, vtt2txt, write_txt, Journal, RateLimiter, \
+  call_limited, YtdlEngine, YtdlError, VideoUnavailableError
+from videolist import load_videolist
 from tqdm import tqdm
 
 def parse_args():
@@ -15,76 +16,229 @@ def parse_args():
     formatter_class=argparse.ArgumentDefaultsHelpFormatter,
   )
   parser.add_argument("lang",         type=str, help="language code (ja, en, ...)")
-  parser.add_argument("sublist",      type=str, help="filename of list of video IDs with subtitles")  
+  parser.add_argument("sublist",      type=str, help="filename of list of video IDs with subtitles (csv, parquet or feather)")
   parser.add_argument("--outdir",     type=str, default="video", help="dirname to save videos")
   parser.add_argument("--keeporg",    action='store_true', default=False, help="keep original audio file.")
-  return parser.parse_args(sys.argv[1:])
+  parser.add_argument("--journal",    type=str, default="journal.sqlite", help="filename of job journal (for restart downloading)")
+  parser.add_argument("--download-workers", type=int, default=1, help="number of concurrent downloads")
+  parser.add_argument("--convert-workers",  type=int, default=1, help="number of processes for subtitle conversion and resampling")
+  parser.add_argument("--queue-size", type=int, default=None, help="max. number of downloaded videos waiting for conversion (default: 2 * convert-workers)")
+  parser.add_argument("--rate",       type=float, default=0.1, help="max. number of downloads per second (<=0: unlimited)")
+  parser.add_argument("--format",     type=str, default="wav", choices=["wav", "flac"], help="file format of 16kHz audio (flac: lossless, about half the size)")
+  parser.add_argument("--direct",     action='store_true', default=False, help="decode the audio stream directly to 16kHz wav, without the original wav file (not with --keeporg)")
+  args = parser.parse_args(sys.argv[1:])
+  if args.direct and args.keeporg:
+    parser.error("--direct does not write the original audio file; it cannot be used with --keeporg.")
+  return args
 
-def download_video(lang, fn_sub, outdir="video", wait_sec=10, keep_org=False):
+def make_filenames(videoid, lang, outdir="video", audio_format="wav"):
+  fn = {}
+  for k in ["wav", "wav16k", "vtt", "txt"]:
+    ext = audio_format if k == "wav16k" else k[:3]
+    fn[k] = Path(outdir) / lang / k / (make_basename(videoid) + "." + ext)
+    fn[k].parent.mkdir(parents=True, exist_ok=True)
+  return fn
+
+
+def make_engine(lang, outdir="video", direct=False):
+  # same as "yt-dlp --sub-lang {lang} --extract-audio --audio-format wav --write-sub {url} -o {base}.%(ext)s",
+  # where {base} = {outdir}/{lang}/wav/{make_basename(videoid)}
+  # direct=True: only the subtitle is downloaded; the URL of the audio stream is returned in the info dict
+  audio = {"skip_download": True} if direct else {"postprocessors": [{"key": "FFmpegExtractAudio", "preferredcodec": "wav"}]}
+  return YtdlEngine(
+    format="bestaudio/best",
+    outtmpl=str(Path(outdir) / lang / "wav" / "%(id).2s" / "%(id)s.%(ext)s"),
+    writesubtitles=True,
+    subtitleslangs=[lang],
+    **audio,
+  )
+
+
+def fetch_video(videoid, lang, fn, engine, limiter=None, direct=False):
+  """Network stage: download audio and subtitle with `engine` (see make_engine). Returns an error or None.
+
+  With direct=True, the audio stream is decoded by ffmpeg to wav16k here (no original wav is written).
+  """
+  print(videoid)
+
+  # download (waiting and retrying at a lower rate if rate limited)
+  url = make_video_url(videoid)
+  base = fn["wav"].parent.joinpath(fn["wav"].stem)
+  try:
+    info = call_limited(engine.download, videoid, limiter=limiter)
+  except YtdlError as e:
+    print(f"Failed to download the video: url = {url}, error = {e}")
+    return e
+  try:
+    shutil.move(f"{base}.{lang}.vtt", fn["vtt"])
+  except Exception as e:
+    print(f"Failed to rename subtitle file. The download may have failed: url = {url}, filename = {base}.{lang}.vtt, error = {e}")
+    return str(e)
+
+  # audio stream -> wav16k (resampling to 16kHz, 1ch)
+  if direct:
+    try:
+      decode_normalize(info["url"], fn["wav16k"], fs=16000, headroom=5.0, http_headers=info.get("http_headers"))
+    except Exception as e:
+      print(f"Failed to decode the audio stream: url = {url}, error = {e}")
+      return str(e)
+  return None
+
+
+def convert_video(videoid, fn, keep_org=False, direct=False):
+  """CPU stage: vtt -> txt and wav -> wav16k (already done with direct=True). Returns an error message or None."""
+  url = make_video_url(videoid)
+
+  # vtt -> txt (reformatting)
+  try:
+    with open(fn["vtt"], "r") as f:
+      txt = vtt2txt(f)
+    write_txt(fn["txt"], txt)
+  except Exception as e:
+    print(f"Falied to convert subtitle file to txt file: url = {url}, filename = {fn['vtt']}, error = {e}")
+    return str(e)
+  if direct:
+    return None
+
+  # wav -> wav16k (resampling to 16kHz, 1ch)
+  try:
+    normalize_resample(fn["wav"], fn["wav16k"], fs=16000, headroom=5.0)
+  except Exception as e:
+    print(f"Failed to normalize or resample downloaded audio: url = {url}, filename = {fn['wav']}, error = {e}")
+    return str(e)
+
+  # remove original wav
+  if not keep_org:
+    try:
+      fn["wav"].unlink()
+    except Exception as e:
+      print(f"Failed to remove downloaded audio: url = {url}, filename = {fn['wav']}, error = {e}")
+      return str(e)
+  return None
+
+
+def download_video(lang, fn_sub, outdir="video", wait_sec=10, keep_org=False, fn_journal="journal.sqlite",
+    download_workers=1, convert_workers=1, queue_size=None, rate=None, direct=False,
+    audio_format="wav"):
   """
   Tips:
     If you want to download automatic subtitles instead of manual subtitles, please change as follows.
-      1. replace "sub[sub["sub"]==True]" of for-loop with "sub[sub["auto"]==True]"
-      2. replace "--write-sub" option of yt-dlp with "--write-auto-sub"
-      3. replace vtt2txt() with autovtt2txt()
+      1. replace "sub=True" of load_videolist() with "auto=True"
+      2. replace "writesubtitles=True" of make_engine() with "writeautomaticsub=True"
+      3. replace vtt2txt() with autovtt2txt() (imported from util)
       4 (optional). change fn["vtt"] (path to save subtitle) to another. 
+    Finished and failed videos are recorded in the job journal (keyed by {outdir}/{lang}). On restart, finished
+    videos are skipped if their files still exist, and failed videos are retried up to 3 times.
+    Downloading (threads, `download_workers`) and conversion (processes, `convert_workers`) run as separate stages.
+    At most `queue_size` downloaded videos wait for conversion. `rate` (downloads per second) limits the network
+    stage only; if it is None, 1 / wait_sec is used. yt-dlp runs in the download threads (YtdlEngine);
+    unavailable videos are not retried. If YouTube refuses downloads (HTTP 429), all download threads pause and
+    continue at half the rate.
+    The subtitle list can be a CSV file or converted by videolist.py (Parquet/Feather loads much faster).
+    With direct=True, ffmpeg decodes the audio stream to 16kHz, 1ch in the download threads, so the original
+    (full-rate) wav file is never written, and the conversion stage only converts subtitles.
+    With audio_format="flac", 16kHz audio is stored as {outdir}/{lang}/wav16k/**/*.flac (lossless, about half the size).
+    align.py and export_clips.py read both formats.
   """
+  if direct and keep_org:
+    raise ValueError("direct=True does not write the original audio file; it cannot be used with keep_org=True.")
 
-  sub = pd.read_csv(fn_sub)
-
-  for videoid in tqdm(sub[sub["sub"]==True]["videoid"]): # manual subtitle only
-    fn = {}
-    for k in ["wav", "wav16k", "vtt", "txt"]:
-      fn[k] = Path(outdir) / lang / k / (make_basename(videoid) + "." + k[:3])
-      fn[k].parent.mkdir(parents=True, exist_ok=True)
+  sub = load_videolist(fn_sub, columns=["videoid"], sub=True) # manual subtitle only
+  journal = Journal(fn_journal, f"download_video/{(Path(outdir) / lang).resolve()}/{Path(fn_sub).stem}")
 
-    if not fn["wav16k"].exists() or not fn["txt"].exists():
-      print(videoid)
+  if rate is None:
+    rate = 1.0 / wait_sec if wait_sec > 0.01 else 0
+  limiter = RateLimiter(rate)
+  engine = make_engine(lang, outdir, direct)
+  queue_size = queue_size or 2 * convert_workers
 
-      # download
-      url = make_video_url(videoid)
-      base = fn["wav"].parent.joinpath(fn["wav"].stem)
-      cp = subprocess.run(f"yt-dlp --sub-lang {lang} --extract-audio --audio-format wav --write-sub {url} -o {base}.\%\(ext\)s", shell=True,universal_newlines=True)
-      if cp.returncode != 0:
-        print(f"Failed to download the video: url = {url}")
+  def videoids():
+    for videoid in sub["videoid"]:
+      done = journal.is_done(videoid)
+      if not done and not journal.should_run(videoid):
         continue
-      try:
-        shutil.move(f"{base}.{lang}.vtt", fn["vtt"])
-      except Exception as e:
-        print(f"Failed to rename subtitle file. The download may have failed: url = {url}, filename = {base}.{lang}.vtt, error = {e}")
+      fn = make_filenames(videoid, lang, outdir, audio_format)
+      # 16kHz audio of any format (wav, flac)
+      exists = fn["txt"].exists() and any(fn["wav16k"].with_suffix(ext).exists() for ext in AUDIO_FORMATS)
+      if done and exists:
         continue
-
-      # vtt -> txt (reformatting)
-      try:
-        txt = vtt2txt(open(fn["vtt"], "r").readlines())
-        with open(fn["txt"], "w") as f:
-          f.writelines([f"{t[0]:1.3f}\t{t[1]:1.3f}\t\"{t[2]}\"\n" for t in txt])
-      except Exception as e:
-        print(f"Falied to convert subtitle file to txt file: url = {url}, filename = {fn['vtt']}, error = {e}")
+      # videos downloaded before the journal existed
+      if videoid not in journal and exists:
+        journal.done(videoid)
         continue
+      # not done, or done but its files were removed
+      yield videoid, fn
 
-      # wav -> wav16k (resampling to 16kHz, 1ch)
-      try:
-        wav = pydub.AudioSegment.from_file(fn["wav"], format = "wav")
-        wav = pydub.effects.normalize(wav, 5.0).set_frame_rate(16000).set_channels(1)
-        wav.export(fn["wav16k"], format="wav", bitrate="16k")
-      except Exception as e:
-        print(f"Failed to normalize or resample downloaded audio: url = {url}, filename = {fn['wav']}, error = {e}")
-        continue
+  todo = videoids()
+  pbar = tqdm()
+  converter = ProcessPoolExecutor(max_workers=convert_workers)
+
+  def convert(videoid, fn):
+    # a pool whose process died (e.g. killed by the OOM killer) is broken for good and is replaced
+    nonlocal converter
+    try:
+      return converter.submit(convert_video, videoid, fn, keep_org, direct), converter
+    except BrokenProcessPool:
+      converter.shutdown(wait=False)
+      converter = ProcessPoolExecutor(max_workers=convert_workers)
+      return converter.submit(convert_video, videoid, fn, keep_org, direct), converter
 
-      # remove original wav
-      if not keep_org:
-        fn["wav"].unlink()
+  try:
+    with ThreadPoolExecutor(max_workers=download_workers) as downloader:
+      downloading, converting = {}, {}
+      while True:
+        # fill the network stage while the conversion queue has room
+        while len(downloading) < download_workers and len(downloading) + len(converting) < download_workers + queue_size:
+          item = next(todo, None)
+          if item is None:
+            break
+          videoid, fn = item
+          journal.start(videoid)
+          downloading[downloader.submit(fetch_video, videoid, lang, fn, engine, limiter, direct)] = (videoid, fn)
+        if len(downloading) == 0 and len(converting) == 0:
+          break
 
-      # wait
-      if wait_sec > 0.01:
-        time.sleep(wait_sec)
+        finished, _ = wait(list(downloading) + list(converting), return_when=FIRST_COMPLETED)
+        for future in finished:
+          if future in downloading:
+            videoid, fn = downloading.pop(future)
+            error = future.result()
+            if error is None:
+              future, pool = convert(videoid, fn)
+              converting[future] = (videoid, pool)
+            else:
+              journal.failed(videoid, error, retry=not isinstance(error, VideoUnavailableError))
+              pbar.update(1)
+          else:
+            videoid, pool = converting.pop(future)
+            try:
+              error = future.result()
+            except BrokenProcessPool as e:
+              print(f"Conversion process died: videoid = {videoid}, error = {e}")
+              error = f"conversion process died: {e}"
+              if pool is converter:
+                converter.shutdown(wait=False)
+                converter = ProcessPoolExecutor(max_workers=convert_workers)
+            except Exception as e:
+              print(f"Failed to convert video: videoid = {videoid}, error = {e}")
+              error = str(e)
+            if error is None:
+              journal.done(videoid)
+            else:
+              journal.failed(videoid, error)
+            pbar.update(1)
+  finally:
+    converter.shutdown()
 
+  pbar.close()
+  journal.close()
   return Path(outdir) / lang
 
 if __name__ == "__main__":
   args = parse_args()
 
-  dirname = download_video(args.lang, args.sublist, args.outdir, keep_org=args.keeporg)
+  dirname = download_video(args.lang, args.sublist, args.outdir, keep_org=args.keeporg, fn_journal=args.journal, \
+    download_workers=args.download_workers, convert_workers=args.convert_workers, queue_size=args.queue_size, rate=args.rate, \
+    direct=args.direct, audio_format=args.format)
   print(f"save {args.lang.upper()} videos to {dirname}.")
 
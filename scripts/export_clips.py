@@ -0,0 +1,139 @@
+import io
+import os
+import json
+import time
+import tarfile
+import argparse
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import soundfile as sf
+from tqdm import tqdm
+from audio import AUDIO_FORMATS
+
+def parse_args():
+  parser = argparse.ArgumentParser(
+    description="Exporting aligned utterances as audio clips in tar shards.",
+    formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+  )
+  parser.add_argument("segments",     type=str, help="segments file of align.py (segments.txt or segments.parquet)")
+  parser.add_argument("wavdir",       type=str, help="dirname of 16kHz wav or flac files (video/{lang}/wav16k)")
+  parser.add_argument("--outdir",     type=str, default="clips", help="dirname to save shards")
+  parser.add_argument("--min-score",  type=float, default=-0.3, help="min. confidence score of utterances")
+  parser.add_argument("--shard-size", type=int, default=1000, help="number of utterances per shard")
+  parser.add_argument("--workers",    type=int, default=os.cpu_count(), help="number of processes")
+  return parser.parse_args(sys.argv[1:])
+
+
+def read_segments(fn_segments, min_score=None):
+  # {file: [(utt_id, start, end, score, text), ...]}, files in the order of the segments file
+  if Path(fn_segments).suffix == ".parquet":
+    from segment_store import SegmentReader
+    table = SegmentReader(fn_segments).read(min_score=min_score).to_pydict()
+    rows = zip(table["utt_id"], table["file"], table["start"], table["end"], table["score"], table["text"])
+  else:
+    # "utt_id file start end score [text]" per line
+    rows = (line.rstrip("\n").split(" ", 5) + [""] for line in open(fn_segments, "r") if line.strip() != "")
+    rows = ((u, f, float(s), float(e), float(c), t) for u, f, s, e, c, t, *_ in rows)
+
+  # a file aligned again in an appending run has several blocks of rows; the last block is kept
+  segments, last = {}, None
+  for utt_id, name, start, end, score, text in rows:
+    if name != last:
+      segments.pop(name, None)
+      segments[name] = []
+      last = name
+    if min_score is None or score >= min_score:
+      segments[name].append((utt_id, start, end, score, text or ""))
+  return {name: utts for name, utts in segments.items() if len(utts) > 0}
+
+
+def make_shards(segments, shard_size=1000):
+  # consecutive files are grouped into shards of about `shard_size` utterances; a file is never split
+  shards, shard, n_utt = [], [], 0
+  for name, utts in segments.items():
+    shard.append((name, utts))
+    n_utt += len(utts)
+    if n_utt >= shard_size:
+      shards.append(shard)
+      shard, n_utt = [], 0
+  if len(shard) > 0:
+    shards.append(shard)
+  return shards
+
+
+def add_bytes(tar, name, data):
+  info = tarfile.TarInfo(name)
+  info.size = len(data)
+  info.mtime = int(time.time())
+  tar.addfile(info, io.BytesIO(data))
+
+
+def export_shard(fn_shard, shard, wavs):
+  """Write the utterances of `shard` to a tar file, reading each wav file once from start to end."""
+  n_clip = 0
+  fn_part = fn_shard.with_name(fn_shard.name + ".part")
+  with tarfile.open(fn_part, "w") as tar:
+    for name, utts in shard:
+      if wavs.get(name) is None:
+        print(f"No audio file found for {name}.")
+        continue
+      try:
+        with sf.SoundFile(str(wavs[name])) as f:
+          # PCM_16 samples are copied to the clips as they are
+          dtype = "int16" if f.subtype == "PCM_16" else "float32"
+          for utt_id, start, end, score, text in sorted(utts, key=lambda u: u[1]):
+            s = min(int(round(start * f.samplerate)), f.frames)
+            e = min(int(round(end * f.samplerate)), f.frames)
+            f.seek(s)
+            clip = f.read(e - s, dtype=dtype)
+            buffer = io.BytesIO()
+            sf.write(buffer, clip, f.samplerate, subtype="PCM_16", format="WAV")
+            meta = {"file": name, "start": start, "end": end, "score": score}
+            add_bytes(tar, f"{utt_id}.wav", buffer.getvalue())
+            add_bytes(tar, f"{utt_id}.txt", text.encode("utf-8"))
+            add_bytes(tar, f"{utt_id}.json", json.dumps(meta).encode("utf-8"))
+            n_clip += 1
+      except Exception as e:
+        print(f"Failed to export utterances: filename = {wavs[name]}, error = {e}")
+  fn_part.rename(fn_shard)
+  return n_clip
+
+
+def export_clips(fn_segments, wavdir, outdir="clips", min_score=-0.3, shard_size=1000, workers=1):
+  """
+  Tips:
+    Utterances with a confidence score >= min_score are written to {outdir}/shard-NNNNNN.tar as
+    {utt_id}.wav, {utt_id}.txt and {utt_id}.json (file, start, end, score), i.e. in WebDataset layout.
+    Audio files can be wav or flac. Shards are written in parallel by `workers` processes. Each audio file is
+    read once, clip by clip in the order of time. Shards already written are skipped on restart (with the same segments, min_score
+    and shard_size). If a file has several blocks of segments (aligned again in an appending run), only its last block is
+    exported.
+  """
+  segments = read_segments(fn_segments, min_score)
+  wavs = {fn.stem: fn for fn in Path(wavdir).glob("**/*") if fn.suffix in AUDIO_FORMATS}
+  shards = make_shards(segments, shard_size)
+  outdir = Path(outdir)
+  outdir.mkdir(parents=True, exist_ok=True)
+
+  todo = [(outdir / f"shard-{i:06d}.tar", shard) for i, shard in enumerate(shards)]
+  todo = [(fn_shard, shard) for fn_shard, shard in todo if not fn_shard.exists()]
+
+  start = time.perf_counter()
+  n_clip = 0
+  with ProcessPoolExecutor(max_workers=workers) as executor:
+    futures = [executor.submit(export_shard, fn_shard, shard, {name: wavs.get(name) for name, _ in shard}) \
+      for fn_shard, shard in todo]
+    for future in tqdm(futures):
+      n_clip += future.result()
+  elapsed = time.perf_counter() - start
+
+  print(f"exported {n_clip} utterances to {len(todo)}/{len(shards)} shards in {elapsed:.1f} s ({n_clip / max(elapsed, 1e-9):.1f} utterances/s).")
+  return outdir
+
+
+if __name__ == "__main__":
+  args = parse_args()
+
+  dirname = export_clips(args.segments, args.wavdir, args.outdir, args.min_score, args.shard_size, args.workers)
+  print(f"save clips to {dirname}.")
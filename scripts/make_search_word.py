@@ -1,7 +1,9 @@
 import requests
 import bz2
+import heapq
 import argparse
 import sys
+import tempfile
 from util import make_dump_url
 from pathlib import Path
 
@@ -12,35 +14,89 @@ def parse_args():
   )
   parser.add_argument("lang",     type=str, help="language code (ja, en, ...)")
   parser.add_argument("--outdir", type=str, default="word", help="dirname to save words")
+  parser.add_argument("--chunk",  type=int, default=1000000, help="number of words sorted in memory at once")
   return parser.parse_args(sys.argv[1:])
 
 
-def make_search_word(lang, outdir="word"):
+def download_file(url, fn, chunk_size=2**20):
+  # stream to {fn}.part and resume it if a previous download was interrupted
+  fn_part = fn.with_name(fn.name + ".part")
+  size = fn_part.stat().st_size if fn_part.exists() else 0
+  headers = {"Range": f"bytes={size}-"} if size > 0 else {}
+
+  with requests.get(url, headers=headers, stream=True, timeout=60) as r:
+    if r.status_code == 416: # already complete
+      fn_part.rename(fn)
+      return fn
+    r.raise_for_status()
+    with open(fn_part, "ab" if r.status_code == 206 else "wb") as f:
+      for chunk in r.iter_content(chunk_size=chunk_size):
+        f.write(chunk)
+
+  fn_part.rename(fn)
+  return fn
+
+
+def iter_words(fn_index):
+  # "offset:pageid:title" per line -> title
+  with bz2.open(fn_index, "rt", encoding="utf-8") as f:
+    for line in f:
+      w = line.rstrip("\n").split(":")[-1].strip(" ")
+      if len(w) > 0:
+        yield w
+
+
+def sort_unique(words, fn_out, tmpdir, chunk=1000000):
+  # external merge sort: sorted runs of `chunk` words on disk, then a k-way merge dropping duplicates
+  runs, buffer = [], set()
+
+  def flush():
+    fn_run = Path(tmpdir) / f"run{len(runs):05d}.txt"
+    with open(fn_run, "w", encoding="utf-8") as f:
+      f.writelines([w + "\n" for w in sorted(buffer)])
+    runs.append(fn_run)
+    buffer.clear()
+
+  for w in words:
+    buffer.add(w)
+    if len(buffer) >= chunk:
+      flush()
+  if len(buffer) > 0 or len(runs) == 0:
+    flush()
+
+  files = [open(fn_run, "r", encoding="utf-8") for fn_run in runs]
+  try:
+    with open(fn_out, "w", encoding="utf-8") as f:
+      prev = None
+      for w in heapq.merge(*files):
+        if w != prev:
+          f.write(w)
+          prev = w
+  finally:
+    for fr in files:
+      fr.close()
+
+
+def make_search_word(lang, outdir="word", chunk=1000000):
   # download wikipedia index
   url = make_dump_url(lang)
   fn_index = Path(outdir) / "dump" / lang / Path(url).name # xxx.txt.bz2
   fn_index.parent.mkdir(parents=True, exist_ok=True)
 
   if not fn_index.exists():
-    with open(fn_index, "wb") as f:
-      f.write(requests.get(url).content)
+    download_file(url, fn_index)
 
   # obtain words
-  fn_word = Path(outdir) / "word" / lang / fn_index.stem 
+  fn_word = Path(outdir) / "word" / lang / fn_index.stem
   fn_word.parent.mkdir(parents=True, exist_ok=True)
 
-  with bz2.open(fn_index, "rt", encoding="utf-8") as f:
-    words = list(map(lambda x: x.strip("\n").split(":")[-1], f.readlines()))
-  words = [w.strip(" ") for w in set(words) if len(w) > 0]
-  words.sort()
-
-  with open(fn_word, "w", encoding="utf-8") as f:
-    f.writelines([w + "\n" for w in words])
+  with tempfile.TemporaryDirectory(dir=fn_word.parent) as tmpdir:
+    sort_unique(iter_words(fn_index), fn_word, tmpdir, chunk)
 
   return fn_word
 
 if __name__ == "__main__":
   args = parse_args()
 
-  filename = make_search_word(args.lang, args.outdir)
+  filename = make_search_word(args.lang, args.outdir, args.chunk)
   print(f"save {args.lang.upper()} words to {filename}.")
@@ -0,0 +1,88 @@
+import argparse
+import csv
+import sys
+from pathlib import Path
+from util import obtain_channelid, make_session, imap_ordered, RateLimiter, MetadataStore
+from videolist import load_videolist
+from tqdm import tqdm
+
+def parse_args():
+  parser = argparse.ArgumentParser(
+    description="Obtaining channel IDs of videos.",
+    formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+  )
+  parser.add_argument("lang",       type=str, help="language code (ja, en, ...)")
+  parser.add_argument("sublist",    type=str, help="filename of subtitle list (csv, parquet or feather)")
+  parser.add_argument("--outdir",   type=str, default="channel", help="dirname to save results")
+  parser.add_argument("--workers",  type=int, default=1, help="number of concurrent requests")
+  parser.add_argument("--rate",     type=float, default=5.0, help="max. number of requests per second (over all workers, <=0: unlimited)")
+  parser.add_argument("--metadata", type=str, default="metadata.sqlite", help="filename of metadata store (cache of channel IDs)")
+  parser.add_argument("--host",     type=str, default="https://www.youtube.com", help="host of the video pages (e.g., a local server for testing)")
+  return parser.parse_args(sys.argv[1:])
+
+
+def resolve_channelid(videoid, session, store=None, limiter=None, host="https://www.youtube.com"):
+  # cached (by a probe or an earlier run) -> no request
+  channelid = store.get_channelid(videoid) if store is not None else None
+  if channelid is not None:
+    return channelid
+
+  if limiter is not None:
+    limiter.acquire()
+  channelid = obtain_channelid(videoid, session, host)
+  if channelid is not None and store is not None:
+    store.set_channelid(videoid, channelid)
+  return channelid
+
+
+def obtain_channelids(lang, fn_sub, outdir="channel", workers=1, rate=5.0, fn_metadata="metadata.sqlite",
+    host="https://www.youtube.com", session=None):
+  """
+  Tips:
+    Writes the subtitle list with the `channelid` column filled to {outdir}/{lang}/{stem}.csv, in the order of the list.
+    Video pages are fetched concurrently (`workers`) over a pooled HTTP session, at most `rate` pages per second,
+    and kept in memory. The channel ID is found independently of the page language (util.extract_channelid).
+    Channel IDs already in the list or in the metadata store (`fn_metadata`) are not fetched again, so an
+    interrupted run restarts where it stopped. Videos without a channel ID (e.g., removed) are written with an empty one.
+    `session` (anything with a requests-like `get`) and `host` can be replaced, e.g. by a local server for testing.
+  """
+  fn_out = Path(outdir) / lang / f"{Path(fn_sub).stem}.csv"
+  fn_out.parent.mkdir(parents=True, exist_ok=True)
+
+  sub = load_videolist(fn_sub)
+  if "channelid" not in sub.columns:
+    sub["channelid"] = None
+  store = MetadataStore(fn_metadata) if fn_metadata is not None else None
+  limiter = RateLimiter(rate, burst=max(1, workers))
+  session = session or make_session(pool_size=max(10, workers))
+
+  def resolve(row):
+    if isinstance(row["channelid"], str) and len(row["channelid"]) > 0:
+      return row["channelid"]
+    try:
+      return resolve_channelid(row["videoid"], session, store, limiter, host)
+    except Exception as e:
+      print(f"Failed to obtain channel ID: videoid = {row['videoid']}, error = {e}")
+      return None
+
+  n_found = 0
+  with open(fn_out, "w", newline="") as f:
+    writer = csv.DictWriter(f, fieldnames=["videoid", "auto", "sub", "channelid"], extrasaction="ignore")
+    writer.writeheader()
+    rows = sub.to_dict("records")
+    for row, channelid in tqdm(imap_ordered(resolve, rows, workers), total=len(rows)):
+      row["channelid"] = channelid or ""
+      n_found += int(channelid is not None)
+      writer.writerow(row)
+
+  print(f"found channel IDs of {n_found}/{len(sub)} videos.")
+  if store is not None:
+    store.close()
+  return fn_out
+
+
+if __name__ == "__main__":
+  args = parse_args()
+
+  filename = obtain_channelids(args.lang, args.sublist, args.outdir, args.workers, args.rate, args.metadata, args.host)
+  print(f"save {args.lang.upper()} channel IDs to {filename}.")
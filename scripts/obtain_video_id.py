@@ -1,10 +1,9 @@
-import time
-import requests
 import argparse
 import re
 import sys
+from contextlib import nullcontext
 from pathlib import Path
-from util import make_query_url
+from util import make_query_url, make_session, Journal, RateLimiter, VideoIdIndex, imap_ordered
 from tqdm import tqdm
 
 
@@ -14,41 +13,104 @@ def parse_args():
     formatter_class=argparse.ArgumentDefaultsHelpFormatter,
   )
   parser.add_argument("lang",     type=str, help="language code (ja, en, ...)")
-  parser.add_argument("wordlist", type=str, help="filename of word list")  
+  parser.add_argument("wordlist", type=str, help="filename of word list")
   parser.add_argument("--outdir", type=str, default="videoid", help="dirname to save video IDs")
+  parser.add_argument("--journal", type=str, default="journal.sqlite", help="filename of job journal (for restart)")
+  parser.add_argument("--workers", type=int, default=1, help="number of concurrent search requests")
+  parser.add_argument("--rate",    type=float, default=5.0, help="max. number of search requests per second (over all workers, <=0: unlimited)")
+  parser.add_argument("--index",   type=str, default=None, help="filename of index of video IDs found so far (default: {outdir}/index.sqlite)")
+  parser.add_argument("--no-dedup", action="store_true", default=False, help="write all video IDs, including ones found before")
+  parser.add_argument("--host",    type=str, default="https://www.youtube.com", help="host of the search page (e.g., a local server for testing)")
   return parser.parse_args(sys.argv[1:])
 
 
-def obtain_video_id(lang, fn_word, outdir="videoid", wait_sec=0.2):
+VIDEOID_PATTERN = re.compile(rb"\"videoId\":\"([\w\_\-]+?)\"")
+
+
+def find_video_ids(chunks) -> list:
+  # find video IDs in a stream of bytes; the tail of each chunk is kept for IDs across chunk boundaries
+  videoids, tail = {}, b""
+  for chunk in chunks:
+    buffer = tail + chunk
+    for m in VIDEOID_PATTERN.finditer(buffer):
+      videoids[m.group(1).decode()] = None
+    tail = buffer[-64:]
+  return list(videoids)
+
+
+def search_video_id(word, session, host="https://www.youtube.com", limiter=None, timeout=30):
+  if limiter is not None:
+    limiter.acquire()
+
+  # download search results
+  url = make_query_url(word, host)
+  with session.get(url, stream=True, timeout=timeout) as response:
+    response.raise_for_status()
+    return find_video_ids(response.iter_content(chunk_size=65536))
+
+
+def obtain_video_id(lang, fn_word, outdir="videoid", wait_sec=0.2, fn_journal="journal.sqlite",
+    workers=1, rate=None, host="https://www.youtube.com", session=None, fn_index=None, dedup=True):
+  """
+  Tips:
+    With workers > 1, search requests are sent concurrently over a pooled HTTP session. Video IDs are still
+    written in the order of the word list. `rate` (requests per second over all workers) replaces the per-word
+    `wait_sec` sleep; if it is None, 1 / wait_sec is used. Requests failed with 429 or 5xx are retried with backoff.
+    `session` (anything with a requests-like `get`) and `host` can be replaced, e.g. by a local server for testing.
+    With dedup=True, only video IDs not found before (by any word, run or language sharing `fn_index`) are written,
+    and an existing list is appended to as long as the index is not empty, even if the journal is new.
+    The number of found and new video IDs per word is written to {stem}.yield.tsv to see when searching stops paying off.
+  """
   fn_videoid = Path(outdir) / lang / f"{Path(fn_word).stem}.txt"
   fn_videoid.parent.mkdir(parents=True, exist_ok=True)
+  fn_yield = fn_videoid.with_suffix(".yield.tsv")
+  index = VideoIdIndex(fn_index or Path(outdir) / "index.sqlite") if dedup else None
 
-  with open(fn_videoid, "w") as f:
-    for word in tqdm(list(open(fn_word, "r").readlines())):
-      try:
-        # download search results
-        url = make_query_url(word)
-        html = requests.get(url).content
+  # words already searched are skipped on restart, as long as their output is still there
+  journal = Journal(fn_journal, f"obtain_video_id/{fn_videoid.resolve()}")
+  if not fn_videoid.exists():
+    journal.reset()
 
-        # find video IDs
-        videoids_found = [x.split(":")[1].strip("\"").strip(" ") for x in re.findall(r"\"videoId\":\"[\w\_\-]+?\"", str(html))]
-        videoids_found = list(set(videoids_found))
+  if rate is None:
+    rate = 1.0 / wait_sec if wait_sec > 0.01 else 0
+  limiter = RateLimiter(rate, burst=max(1, workers))
+  session = session or make_session(pool_size=max(10, workers))
 
-        # write
-        f.writelines([v + "\n" for v in videoids_found])
-        f.flush()
-      except:
+  words = (w.rstrip("\n") for w in open(fn_word, "r"))
+  words = (w for w in words if journal.should_run(w))
+
+  def search(word):
+    try:
+      return search_video_id(word, session, host, limiter), None
+    except Exception as e:
+      return None, e
+
+  # IDs in the index were written to the list before and would not be written again (e.g. with a new journal)
+  mode = "a" if len(journal) > 0 or (index is not None and len(index) > 0) else "w"
+  with open(fn_videoid, mode) as f, open(fn_yield, mode) as f_yield:
+    for word, (videoids_found, error) in tqdm(imap_ordered(search, journal.started(words), workers)):
+      if videoids_found is None:
         print(f"No video found for {word}.")
+        journal.failed(word, error)
+        continue
 
-      # wait
-      if wait_sec > 0.01:
-        time.sleep(wait_sec)
+      # write (first-seen video IDs only)
+      with (index.insert_new(videoids_found, lang) if dedup else nullcontext(videoids_found)) as videoids_new:
+        f.writelines([v + "\n" for v in videoids_new])
+        f.flush()
+      f_yield.write(f"{word}\t{len(videoids_found)}\t{len(videoids_new)}\n")
+      f_yield.flush()
+      journal.done(word)
 
+  if index is not None:
+    index.close()
+  journal.close()
   return fn_videoid
 
 
 if __name__ == "__main__":
   args = parse_args()
 
-  filename = obtain_video_id(args.lang, args.wordlist, args.outdir)
+  filename = obtain_video_id(args.lang, args.wordlist, args.outdir, fn_journal=args.journal, \
+    workers=args.workers, rate=args.rate, host=args.host, fn_index=args.index, dedup=not args.no_dedup)
   print(f"save {args.lang.upper()} video IDs to {filename}.")
@@ -1,12 +1,8 @@
-import time
-import requests
 import argparse
-import re
+import csv
 import sys
-import subprocess
 from pathlib import Path
-from util import make_video_url, get_subtitle_language
-import pandas as pd
+from util import YtdlEngine, VideoUnavailableError, subtitle_languages, RateLimiter, call_limited, imap_ordered, Journal, MetadataStore
 from tqdm import tqdm
 
 def parse_args():
@@ -18,54 +14,107 @@ def parse_args():
   parser.add_argument("videoidlist",  type=str, help="filename of video ID list")  
   parser.add_argument("--outdir",     type=str, default="sub", help="dirname to save results")
   parser.add_argument("--checkpoint", type=str, default=None, help="filename of list checkpoint (for restart retrieving)")
+  parser.add_argument("--workers",    type=int, default=1, help="number of concurrent yt-dlp probes")
+  parser.add_argument("--rate",       type=float, default=5.0, help="max. number of probes per second (over all workers, <=0: unlimited)")
+  parser.add_argument("--journal",    type=str, default="journal.sqlite", help="filename of job journal (for restart retrieving)")
+  parser.add_argument("--metadata",   type=str, default="metadata.sqlite", help="filename of metadata store shared by languages (videos probed before are not probed again)")
   return parser.parse_args(sys.argv[1:])
 
 
-def retrieve_subtitle_exists(lang, fn_videoid, outdir="sub", wait_sec=0.2, fn_checkpoint=None):
+def probe_subtitle(videoid, lang, engine, limiter=None, store=None):
+  # a video in the metadata store was probed before (for any language)
+  meta = store.get(videoid) if store is not None else None
+  if meta is not None:
+    return {"videoid": videoid, "auto": lang in meta["auto"], "sub": lang in meta["sub"]}
+
+  # send query to YouTube (waiting and retrying at a lower rate if rate limited)
+  info = call_limited(engine.probe, videoid, limiter=limiter)
+  auto_lang, manu_lang = subtitle_languages(info)
+  if store is not None:
+    store.put(videoid, auto_lang, manu_lang, info.get("channel_id"), info.get("duration"))
+  return {"videoid": videoid, "auto": lang in auto_lang, "sub": lang in manu_lang}
+
+
+def load_checkpoint(fn_checkpoint):
+  # video IDs already retrieved (built once, O(1) lookup per item)
+  with open(fn_checkpoint, "r", newline="") as f:
+    return set(row["videoid"] for row in csv.DictReader(f))
+
+
+def retrieve_subtitle_exists(lang, fn_videoid, outdir="sub", wait_sec=0.2, fn_checkpoint=None, workers=1, rate=None, fn_journal="journal.sqlite",
+    fn_metadata=None):
+  """
+  Tips:
+    With workers > 1, probes run concurrently on a thread pool. Results are still written in the order of the video ID list.
+    `rate` (probes per second over all workers) replaces the per-video `wait_sec` sleep; if it is None, 1 / wait_sec is used.
+    Results are appended to the CSV file row by row, so the output file itself can be passed as `fn_checkpoint` to restart.
+    Without `fn_checkpoint`, the job journal (keyed by the output file) is used for restarting; failed probes are retried up to 3 times,
+    except for unavailable (private, removed, ...) videos. If YouTube refuses probes (HTTP 429), all workers
+    pause and continue at half the rate. yt-dlp runs in this process (YtdlEngine).
+    With `fn_metadata`, the subtitle languages (all of them), channel ID and duration of each probed video are
+    stored, and videos probed before, e.g. for another language, are answered from the store without a request.
+    derive_subtitle_list.py makes subtitle lists of any language from the store.
+  """
   fn_sub = Path(outdir) / lang / f"{Path(fn_videoid).stem}.csv"
   fn_sub.parent.mkdir(parents=True, exist_ok=True)
 
   # if file exists, load it and restart retrieving.
+  journal = Journal(fn_journal, f"retrieve_subtitle_exists/{fn_sub.resolve()}")
+  videoids_done = set() if fn_checkpoint is None else load_checkpoint(fn_checkpoint)
   if fn_checkpoint is None:
-    subtitle_exists = pd.DataFrame({"videoid": [], "auto": [], "sub": []}, dtype=str)
+    resume_inplace = len(journal) > 0 and fn_sub.exists()
   else:
-    subtitle_exists = pd.read_csv(fn_checkpoint)
+    resume_inplace = Path(fn_checkpoint).resolve() == fn_sub.resolve()
+  if not resume_inplace:
+    # the output is written anew, so videos done before have to be probed (or carried over) again
+    journal.reset()
+
+  # global rate limit shared by all workers
+  if rate is None:
+    rate = 1.0 / wait_sec if wait_sec > 0.01 else 0
+  limiter = RateLimiter(rate, burst=max(1, workers))
+  engine = YtdlEngine()
+  store = MetadataStore(fn_metadata) if fn_metadata is not None else None
 
   # load video ID list
-  n_video = 0
-  for videoid in tqdm(open(fn_videoid).readlines()):
-    videoid = videoid.strip(" ").strip("\n")
-    if videoid in set(subtitle_exists["videoid"]):
-      continue
-
-    # send query to YouTube
-    url = make_video_url(videoid)
+  videoids = (v.strip(" ").strip("\n") for v in open(fn_videoid))
+  videoids = (v for v in videoids if len(v) > 0 and v not in videoids_done and journal.should_run(v))
+
+  def probe(videoid):
     try:
-      result = subprocess.check_output(f"yt-dlp --list-subs --sub-lang {lang} --skip-download {url}", \
-        shell=True, universal_newlines=True)
-      auto_lang, manu_lang = get_subtitle_language(result)
-      subtitle_exists = subtitle_exists.append( \
-        {"videoid": videoid, "auto": lang in auto_lang, "sub": lang in manu_lang}, 
-        ignore_index=True)
-      n_video += 1
-    except:
-      pass
-
-    # write current result
-    if n_video % 100 == 0:
-      subtitle_exists.to_csv(fn_sub, index=None)
-    
-    # sleep
-    if wait_sec > 0.01:
-      time.sleep(wait_sec)
-
-  # write
-  subtitle_exists.to_csv(fn_sub, index=None)
+      return probe_subtitle(videoid, lang, engine, limiter, store), None
+    except Exception as e:
+      return None, e
+
+  with open(fn_sub, "a" if resume_inplace else "w", newline="") as f:
+    writer = csv.DictWriter(f, fieldnames=["videoid", "auto", "sub"])
+    if not resume_inplace:
+      writer.writeheader()
+      # carry over the rows of a checkpoint stored elsewhere
+      if fn_checkpoint is not None:
+        with open(fn_checkpoint, "r", newline="") as f_checkpoint:
+          for row in csv.DictReader(f_checkpoint):
+            writer.writerow({k: row[k] for k in writer.fieldnames})
+      f.flush()
+
+    for videoid, (result, error) in tqdm(imap_ordered(probe, journal.started(videoids), workers)):
+      if result is None:
+        journal.failed(videoid, error, retry=not isinstance(error, VideoUnavailableError))
+        continue
+      # write current result
+      writer.writerow(result)
+      f.flush()
+      journal.done(videoid)
+
+  if store is not None:
+    store.close()
+  journal.close()
   return fn_sub
 
 if __name__ == "__main__":
   args = parse_args()
 
   filename = retrieve_subtitle_exists(args.lang, args.videoidlist, \
-    args.outdir, fn_checkpoint=args.checkpoint)
+    args.outdir, fn_checkpoint=args.checkpoint, workers=args.workers, rate=args.rate, fn_journal=args.journal, \
+    fn_metadata=args.metadata)
   print(f"save {args.lang.upper()} subtitle info to {filename}.")
@@ -0,0 +1,230 @@
+"""Columnar store of aligned segments (Parquet).
+
+A store is a directory (e.g. `segments.parquet/`) of part files. Each flush
+of `SegmentWriter` writes one complete part, `part-NNNNNN.parquet`, and next
+to it `part-NNNNNN.index.json`, which maps each audio file to its rows. So
+segments of all parts written before a crash stay readable, and the
+segments of one file are read without scanning the store. Score filters are
+pushed down to the row groups by their min/max statistics.
+
+Example:
+    reader = SegmentReader("output/segments.parquet")
+    good = reader.read(min_score=-0.3).to_pandas()
+    one_video = reader.read_file("xxxxxxxxxxx")
+"""
+
+import json
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+COLUMNS = ("utt_id", "file", "start", "end", "score", "text")
+
+
+def _schema():
+    return pa.schema(
+        [
+            ("utt_id", pa.string()),
+            ("file", pa.string()),
+            ("start", pa.float64()),
+            ("end", pa.float64()),
+            ("score", pa.float64()),
+            ("text", pa.string()),
+        ]
+    )
+
+
+def part_path(path, num: int):
+    """Path of the `num`-th part file of a segment store."""
+    return Path(path) / f"part-{num:06d}.parquet"
+
+
+def index_path(part):
+    """Path of the per-file index of a part file."""
+    part = Path(part)
+    return part.with_name(part.stem + ".index.json")
+
+
+def _parts(path):
+    # part files in the order they were written
+    return sorted(Path(path).glob("part-*.parquet"))
+
+
+class SegmentWriter:
+    """Write aligned segments to a segment store, one part file per flush.
+
+    Args:
+        path: Directory of the store.
+        row_group_size: Number of segments buffered per part.
+        flush_interval: Seconds after which buffered segments are written,
+            even if fewer than `row_group_size`.
+        append: Add parts to an existing store instead of replacing it.
+    """
+
+    def __init__(
+        self,
+        path,
+        row_group_size: int = 65536,
+        flush_interval: float = 600.0,
+        append: bool = False,
+    ):
+        if not PYARROW_AVAILABLE:
+            raise ImportError("pyarrow is required to write a segment store.")
+        self.path = Path(path)
+        self.row_group_size = row_group_size
+        self.flush_interval = flush_interval
+        self.schema = _schema()
+        if not append:
+            for part in _parts(self.path):
+                index_path(part).unlink(missing_ok=True)
+                part.unlink()
+        self.path.mkdir(parents=True, exist_ok=True)
+        parts = _parts(self.path)
+        self.num_parts = int(parts[-1].stem.split("-")[1]) + 1 if parts else 0
+        self.buffer = {name: [] for name in COLUMNS}
+        self.index = {}  # file -> [first row, number of rows] in the buffer
+        self.last_flush = time.time()
+
+    def write(self, name, utt_ids, segments, text=None):
+        """Append the segments of one audio file.
+
+        Args:
+            name: Name (stem) of the audio file.
+            utt_ids: Utterance IDs.
+            segments: (start, end, score) per utterance.
+            text: Utterance texts.
+        """
+        n = len(utt_ids)
+        self.index[name] = [len(self.buffer["utt_id"]), n]
+        self.buffer["utt_id"] += list(utt_ids)
+        self.buffer["file"] += [name] * n
+        for column, values in zip(("start", "end", "score"), zip(*segments)):
+            self.buffer[column] += values
+        self.buffer["text"] += list(text) if text is not None else [None] * n
+        if (
+            len(self.buffer["utt_id"]) >= self.row_group_size
+            or time.time() - self.last_flush >= self.flush_interval
+        ):
+            self.flush()
+
+    def flush(self):
+        """Write the buffered segments as a new part."""
+        self.last_flush = time.time()
+        if len(self.buffer["utt_id"]) == 0:
+            return
+        part = part_path(self.path, self.num_parts)
+        # written under hidden names first (ignored by readers), index first,
+        # so a part is only visible once it and its index are complete
+        tmp = part.with_name(f".{part.name}")
+        pq.write_table(
+            pa.table(self.buffer, schema=self.schema),
+            str(tmp),
+            row_group_size=self.row_group_size,
+        )
+        tmp_index = tmp.with_name(f".{index_path(part).name}")
+        with open(tmp_index, "w") as f:
+            json.dump(self.index, f)
+        os.replace(tmp_index, index_path(part))
+        os.replace(tmp, part)
+        self.num_parts += 1
+        self.buffer = {name: [] for name in COLUMNS}
+        self.index = {}
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SegmentReader:
+    """Read a segment store written by `SegmentWriter`.
+
+    If an audio file was written to several parts (e.g. aligned again in
+    an appending run), `read` and `read_file` read its latest segments.
+
+    Args:
+        path: Directory of the store.
+    """
+
+    def __init__(self, path):
+        if not PYARROW_AVAILABLE:
+            raise ImportError("pyarrow is required to read a segment store.")
+        self.path = Path(path)
+        self.parts = _parts(self.path)
+        self.index = {}  # file -> (part number, first row, number of rows)
+        for i, part in enumerate(self.parts):
+            with open(index_path(part)) as f:
+                for name, (start, n) in json.load(f).items():
+                    self.index[name] = (i, start, n)
+        self._parquet = {}
+
+    def __len__(self):
+        return sum(n for _, _, n in self.index.values())
+
+    def files(self):
+        """Names of the audio files in the store."""
+        return list(self.index)
+
+    def read(self, min_score: float = None, files=None, columns=None):
+        """Read the latest segments of each audio file as a pyarrow Table.
+
+        Args:
+            min_score: Keep segments with a confidence score >= min_score.
+            files: Keep segments of these audio files.
+            columns: Columns to read (default: all).
+        """
+        # files whose latest segments are in each part
+        latest = [set() for _ in self.parts]
+        for name, (i, _, _) in self.index.items():
+            if files is None or name in files:
+                latest[i].add(name)
+        tables = []
+        for i, part in enumerate(self.parts):
+            if len(latest[i]) == 0:
+                continue
+            filters = []
+            if min_score is not None:
+                filters.append(("score", ">=", min_score))
+            with open(index_path(part)) as f:
+                if files is not None or len(latest[i]) < len(json.load(f)):
+                    filters.append(("file", "in", sorted(latest[i])))
+            tables.append(
+                pq.read_table(
+                    str(part), filters=filters or None, schema=_schema()
+                ).select(columns or list(COLUMNS))
+            )
+        if len(tables) == 0:
+            return _schema().empty_table().select(columns or list(COLUMNS))
+        return pa.concat_tables(tables)
+
+    def read_file(self, name, columns=None):
+        """Read the segments of one audio file by the index."""
+        i, start, n = self.index[name]
+        if i not in self._parquet:
+            parquet = pq.ParquetFile(str(self.parts[i]))
+            metadata = parquet.metadata
+            offsets = np.cumsum(
+                [0]
+                + [metadata.row_group(j).num_rows for j in range(metadata.num_row_groups)]
+            )
+            self._parquet[i] = (parquet, offsets)
+        parquet, offsets = self._parquet[i]
+        first, last = np.searchsorted(
+            offsets, [start, start + max(n, 1) - 1], side="right"
+        ) - 1
+        table = parquet.read_row_groups(list(range(first, last + 1)), columns=columns)
+        return table.slice(start - offsets[first], n)
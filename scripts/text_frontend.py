@@ -0,0 +1,181 @@
+# Copyright 2021, Ludwig Kürzinger, Takaaki Saeki
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+"""Text normalization of subtitles for the aligner (align.py).
+
+Frontends are registered per language code and built on first use, so
+only the packages of the chosen language are imported. Languages without
+an own frontend use `GenericFrontend` (NFKC, numbers spelled out with
+num2words if it supports the language).
+
+Subtitles repeat heavily (jingles, credits, numbers), so normalized
+utterances and transcribed numbers are memoized per frontend.
+`normalize_batch` normalizes many utterances on a process pool.
+"""
+
+import logging
+import re
+import unicodedata
+from abc import ABC, abstractmethod
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from itertools import repeat
+
+FRONTENDS = {}
+
+
+def register_frontend(*langs):
+    """Class decorator registering a frontend for language codes."""
+
+    def register(cls):
+        for lang in langs:
+            FRONTENDS[lang] = cls
+        return cls
+
+    return register
+
+
+class TextFrontend(ABC):
+    """Base class of text frontends.
+
+    Subclasses implement `_normalize`, optionally `_transcribe_number`
+    (numbers are kept by default), and set `cleaner_types` to ESPnet text
+    cleaners to add for the language.
+    """
+
+    cleaner_types = ()
+    number_pattern = re.compile(r"\d+\.?\d*")
+
+    def __init__(self, lang: str):
+        self.lang = lang
+        self.normalize = lru_cache(maxsize=2**16)(self._normalize)
+        self.transcribe_number = lru_cache(maxsize=2**14)(self._transcribe_number)
+
+    def __call__(self, utt_txt: str) -> str:
+        return self.normalize(utt_txt)
+
+    @abstractmethod
+    def _normalize(self, utt_txt: str) -> str:
+        """Normalize one utterance (memoized by `normalize`)."""
+
+    def _transcribe_number(self, number: str) -> str:
+        return number
+
+    def replace_numbers(self, utt_txt: str) -> str:
+        """Replace all the numbers in one pass."""
+        return self.number_pattern.sub(
+            lambda m: self.transcribe_number(m.group()), utt_txt
+        )
+
+    def cache_clear(self):
+        self.normalize.cache_clear()
+        self.transcribe_number.cache_clear()
+
+
+@register_frontend("ja")
+class JapaneseFrontend(TextFrontend):
+    """Japanese: neologdn, romaji to hiragana, numbers in kanji."""
+
+    cleaner_types = ("jaconv",)
+
+    def __init__(self, lang: str = "ja"):
+        super().__init__(lang)
+        from num2words import num2words
+
+        self.num2words = num2words
+        try:
+            import neologdn
+
+            self.neologdn = neologdn
+        except ImportError:
+            logging.error("neologdn is not available!")
+            self.neologdn = None
+        try:
+            import romkan
+
+            self.romkan = romkan
+        except ImportError:
+            logging.error("romkan is not available!")
+            self.romkan = None
+
+    def _transcribe_number(self, number: str) -> str:
+        return self.num2words(number, lang="ja")
+
+    def _normalize(self, utt_txt: str) -> str:
+        # convert UTF-16 latin chars to ASCII
+        if self.neologdn is not None:
+            utt_txt = self.neologdn.normalize(utt_txt)
+        # Romanji to Hiragana
+        if self.romkan is not None:
+            utt_txt = self.romkan.to_hiragana(utt_txt)
+        # replace some special characters
+        utt_txt = utt_txt.replace('"', "").replace(",", "")
+        return self.replace_numbers(utt_txt)
+
+
+class GenericFrontend(TextFrontend):
+    """Any language: NFKC, numbers spelled out with num2words if possible."""
+
+    number_pattern = re.compile(r"\d+(?:\.\d+)?")
+    thousands_separator = re.compile(r"(?<=\d),(?=\d{3})")
+
+    def __init__(self, lang: str):
+        super().__init__(lang)
+        try:
+            from num2words import num2words
+
+            num2words(0, lang=lang)
+            self.num2words = num2words
+        except ImportError:
+            logging.error("num2words is not available!")
+            self.num2words = None
+        except NotImplementedError:
+            logging.warning(f"num2words does not support {lang}, numbers are kept.")
+            self.num2words = None
+
+    def _transcribe_number(self, number: str) -> str:
+        if self.num2words is None:
+            return number
+        return self.num2words(number, lang=self.lang)
+
+    def _normalize(self, utt_txt: str) -> str:
+        # full-width to half-width, compatibility characters
+        utt_txt = unicodedata.normalize("NFKC", utt_txt)
+        utt_txt = self.thousands_separator.sub("", utt_txt).replace('"', "")
+        utt_txt = self.replace_numbers(utt_txt)
+        return " ".join(utt_txt.split())
+
+
+@lru_cache(maxsize=None)
+def get_frontend(lang: str = "ja") -> TextFrontend:
+    """Return the frontend of a language (built once per process)."""
+    return FRONTENDS.get(lang, GenericFrontend)(lang)
+
+
+def text_processing(utt_txt, lang="ja"):
+    """Normalize text.
+    Args:
+        utt_txt: String of text.
+        lang: Language code.
+    Returns:
+        utt_txt: Normalized
+    """
+    return get_frontend(lang)(utt_txt)
+
+
+def normalize_batch(
+    texts, lang: str = "ja", num_workers: int = None, chunksize: int = 256
+):
+    """Normalize a list of utterances on a process pool.
+
+    Args:
+        texts: List of strings.
+        lang: Language code.
+        num_workers: Number of processes (default: number of CPUs).
+        chunksize: Number of utterances sent to a process at once.
+    Returns:
+        List of normalized strings, in the order of `texts`.
+    """
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        return list(
+            executor.map(text_processing, texts, repeat(lang), chunksize=chunksize)
+        )
@@ -1,17 +1,21 @@
 import re
-from datetime import datetime as dt
+import time
+import sqlite3
+import threading
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
-import subprocess
 
 # YouTube video URL
-def make_video_url(videoid: str) -> str:
-  return f"https://www.youtube.com/watch?v={videoid}"
+def make_video_url(videoid: str, host: str = "https://www.youtube.com") -> str:
+  return f"{host}/watch?v={videoid}"
 
 
 # YouTube Search URL
-def make_query_url(query: str) -> str:
+def make_query_url(query: str, host: str = "https://www.youtube.com") -> str:
   q = query.rstrip("\n").strip(" ").replace(" ", "+")
-  return f"https://www.youtube.com/results?search_query={q}&sp=EgQQASgB"
+  return f"{host}/results?search_query={q}&sp=EgQQASgB"
 
 
 # Wikipedia dump file URL
@@ -19,113 +23,529 @@ def make_dump_url(lang: str) -> str:
   return f"https://dumps.wikimedia.org/{lang}wiki/latest/{lang}wiki-latest-pages-articles-multistream-index.txt.bz2"
 
 
+def make_session(pool_size: int = 10, retries: int = 5, backoff: float = 1.0):
+  """requests.Session reusing connections, retrying with exponential backoff on 429 and 5xx."""
+  import requests
+  from requests.adapters import HTTPAdapter
+  from urllib3.util.retry import Retry
+
+  retry = Retry(total=retries, backoff_factor=backoff, status_forcelist=[429, 500, 502, 503, 504],
+    respect_retry_after_header=True)
+  adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+  session = requests.Session()
+  session.mount("http://", adapter)
+  session.mount("https://", adapter)
+  return session
+
+
 def make_basename(videoid: str) -> str:
   return str(Path(videoid[:2]) / videoid)
 
 
-def count_total_second(t: dt) -> float:
-  return t.hour * 3600 + t.minute * 60 + t.second * 1 + t.microsecond * 1e-6
+# channel ID of the video on a watch page, in order of reliability; none of them depends on the page language
+_CHANNELID_PATTERNS = [
+  re.compile(r"\"videoDetails\":\{\"videoId\":\"[\w\-]+\",.*?\"channelId\":\"(UC[\w\-]{22})\""),
+  re.compile(r"<meta itemprop=\"channelId\" content=\"(UC[\w\-]{22})\">"),
+  re.compile(r"\"externalChannelId\":\"(UC[\w\-]{22})\""),
+  re.compile(r"<link itemprop=\"url\" href=\"https?://www\.youtube\.com/channel/(UC[\w\-]{22})\">"),
+  re.compile(r"canonicalBaseUrl\":\"/channel/(UC[\w\-]{22})\"\}\},\"subscriberCountText\""),
+]
+
+
+def extract_channelid(html: str) -> str:
+  # channel ID from the HTML of a watch page, or None
+  for pattern in _CHANNELID_PATTERNS:
+    m = pattern.search(html)
+    if m is not None:
+      return m.group(1)
+  return None
+
+
+def obtain_channelid(videoid: str, session=None, host: str = "https://www.youtube.com", timeout: float = 30) -> str:
+  # the page is kept in memory, so this can run in parallel
+  session = session or make_session()
+  response = session.get(make_video_url(videoid, host), timeout=timeout)
+  response.raise_for_status()
+  return extract_channelid(response.content.decode("utf-8", errors="replace"))
 
 
-def obtain_channelid(videoid: str) -> str:
-  fn_html = Path("temp.html")
+# WebVTT cue timing, e.g. "00:01:02.345 --> 00:01:04.000 align:start position:0%"
+_CUE_TIMING = re.compile(r"(\d+):(\d+):(\d+)\.(\d+) --> (\d+):(\d+):(\d+)\.(\d+)")
+# word of automatic subtitle, e.g. "<00:01:02.500><c> word</c>"
+_AUTO_WORD = re.compile(r"<\d+:\d+:\d+\.\d+><c>(.+?)</c>")
 
-  # download
-  url = make_video_url(videoid)
-  subprocess.run(f"wget {url} -O {fn_html}", shell=True)
 
-  # obtain ID
-  html = "".join(open(fn_html, "r").readlines())
-  try:
-    # only Japanese
-    channelid = re.findall(r"canonicalBaseUrl\":\"/channel/([\w\_\-]+?)\"\}\},\"subscriberCountText\":\{\"accessibility\":\{\"accessibilityData\":\{\"label\":\"チャンネル登録者数", html)[0]
-  except:
-    channelid = None
+# WebVTT cue: start/end time [s], cue settings after the timing, and payload lines up to the next blank line
+Cue = namedtuple("Cue", ["start", "end", "settings", "lines"])
 
-  return channelid
 
+def _parse_second(h: str, m: str, s: str, frac: str) -> float:
+  # integer microseconds (same precision as strptime's "%H:%M:%S.%f")
+  return (((int(h) * 60 + int(m)) * 60 + int(s)) * 1000000 + int(frac[:6].ljust(6, "0"))) / 1000000
 
-def vtt2txt(vtt: list) -> list:
-  txt, is_started = [], False
 
-  for v in vtt:
-    m = re.match(r'(\d+\:\d+\:\d+\.\d+) --> (\d+\:\d+\:\d+\.\d+)', v.strip("\n"))
+def iter_cues(vtt):
+  """Parse WebVTT lines (list or file object) into cues in a single pass."""
+  cue = None
+  for line in vtt:
+    line = line.rstrip("\r\n")
+    m = _CUE_TIMING.match(line) if "-->" in line else None
     if m is not None:
-      st = count_total_second(dt.strptime(m.groups()[0], "%H:%M:%S.%f"))
-      et = count_total_second(dt.strptime(m.groups()[1], "%H:%M:%S.%f"))
-      txt.append([st, et, ""])
-      is_started = True   
-    elif is_started:
-      v = _normalize_text(v)
-      if len(v) == 0:
-        is_started = False
+      if cue is not None:
+        yield cue
+      g = m.groups()
+      cue = Cue(_parse_second(*g[:4]), _parse_second(*g[4:]), line[m.end():], [])
+    elif cue is not None:
+      if len(line) == 0:
+        yield cue
+        cue = None
       else:
-        txt[-1][-1] += " " + v
+        cue.lines.append(line)
+  if cue is not None:
+    yield cue
 
-  # refine
+
+def _refine(txt: list) -> list:
   txt_refined = []
   for t in txt:
     x = _normalize_text(t[2])
     if len(x) > 0:
       txt_refined.append([t[0], t[1], x])
-
   return txt_refined
 
 
+def vtt2txt(vtt) -> list:
+  txt = []
+  for cue in iter_cues(vtt):
+    text = ""
+    for v in cue.lines:
+      v = _normalize_text(v)
+      if len(v) == 0:
+        break
+      text += " " + v
+    txt.append([cue.start, cue.end, text])
+
+  # refine
+  return _refine(txt)
+
+
 def _normalize_text(txt: str) -> str:
   return txt.replace("\n", " ").replace("　", " ").replace("  ", " ").strip(" ").strip("\t").replace("»", "").replace("«", "")
 
 
-def autovtt2txt(vtt: list) -> list:
+def autovtt2txt(vtt) -> list:
   txt = []
 
-  for idx, v in enumerate(vtt):
-    m = re.match(r'(\d+\:\d+\:\d+\.\d+) --> (\d+\:\d+\:\d+\.\d+) align:.+', v.strip("\n"))
-    if m is None:
+  for cue in iter_cues(vtt):
+    # automatic subtitles have cue settings ("align:start position:0%")
+    if not cue.settings.startswith(" align:") or len(cue.settings) <= len(" align:"):
       continue
 
-    st = count_total_second(dt.strptime(m.groups()[0], "%H:%M:%S.%f"))
-    et = count_total_second(dt.strptime(m.groups()[1], "%H:%M:%S.%f"))
-
     text_line = ""
-    for line in [vtt[idx+1], vtt[idx+2]]:
+    for line in cue.lines[:2]:
       line = _normalize_text(line)
-      if len(line) == 0 or "<" not in line:
+      if "<" not in line:
         continue
-      
+
       head = line.split("<")[0]
-      body = re.sub(f"^{head}", "", line)
-      m = re.findall(r"<\d+\:\d+\:\d+\.\d+><c>(.+?)</c>", body)
+      m = _AUTO_WORD.findall(line, len(head))
       if len(m) != 0:
         text_line += head + "".join(m)
 
     if len(text_line) > 0:
-      txt.append([st, et, text_line])
+      txt.append([cue.start, cue.end, text_line])
 
   # refine
-  txt_refined = []
-  for t in txt:
-    x = _normalize_text(t[2])
-    if len(x) > 0:
-      txt_refined.append([t[0], t[1], x])
+  return _refine(txt)
 
-  return txt_refined
+def write_txt(fn_txt, txt: list):
+  # "start<TAB>end<TAB>"text"" per line, read by align.py
+  with open(fn_txt, "w") as f:
+    f.writelines([f"{t[0]:1.3f}\t{t[1]:1.3f}\t\"{t[2]}\"\n" for t in txt])
 
-def get_subtitle_language(response_youtube):
-  lang_code = ["aa","ab","ace","ady","af","ak","als","alt","am","an","ang","ar","arc","ary","arz","as","ast","atj","av","avk","awa","ay","az","azb","ba","ban","bar","bat-smg","bcl","be","be-tarask","bg","bh","bi","bjn","bm","bn","bo","bpy","br","bs","bug","bxr","ca","cbk-zam","cdo","ce","ceb","ch","cho","chr","chy","ckb","co","cr","crh","cs","csb","cu","cv","cy","da","de","din","diq","dsb","dty","dv","dz","ee","el","eml","en","eo","es","et","eu","ext","fa","ff","fi","fiu-vro","fj","fo","fr","frp","frr","fur","fy","ga","gag","gan","gcr","gd","gl","glk","gn","gom","gor","got","gu","gv","ha","hak","haw","he","hi","hif","ho","hr","hsb","ht","hu","hy","hyw","hz","ia","id","ie","ig","ii","ik","ilo","inh","io","is","it","iu","ja","jam","jbo","jv","ka","kaa","kab","kbd","kbp","kg","ki","kj","kk","kl","km","kn","ko","koi","kr","krc","ks","ksh","ku","kv","kw","ky","la","lad","lb","lbe","lez","lfn","lg","li","lij","lld","lmo","ln","lo","lrc","lt","ltg","lv","mad","mai","map-bms","mdf","mg","mh","mhr","mi","min","mk","ml","mn","mni","mnw","mr","mrj","ms","mt","mus","mwl","my","myv","mzn","na","nah","nap","nds","nds-nl","ne","new","ng","nia","nl","nn","no","nov","nqo","nrm","nso","nv","ny","oc","olo","om","or","os","pa","pag","pam","pap","pcd","pdc","pfl","pi","pih","pl","pms","pnb","pnt","ps","pt","qu","rm","rmy","rn","ro","roa-rup","roa-tara","ru","rue","rw","sa","sah","sat","sc","scn","sco","sd","se","sg","sh","shn","si","simple","sk","skr","sl","sm","smn","sn","so","sq","sr","srn","ss","st","stq","su","sv","sw","szl","szy","ta","tay","tcy","te","tet","tg","th","ti","tk","tl","tn","to","tpi","tr","trv","ts","tt","tum","tw","ty","tyv","udm","ug","uk","ur","uz","ve","vec","vep","vi","vls","vo","wa","war","wo","wuu","xal","xh","xmf","yi","yo","za","zea","zh","zh-classical","zh-min-nan",
-  "zh-yue","zu"]
 
-  sub_type = None
-  subtitle = {"auto": [], "sub": []}
-  for r in response_youtube.split("\n"):
-    if r.startswith("Available automatic captions for"):
-      sub_type = "auto"
-    elif r.startswith("Available subtitles for"):
-      sub_type = "sub"
-    elif sub_type is not None:
-      lang = r.split(" ")[0].lower()
-      if lang in lang_code:
-        subtitle[sub_type].append(lang)
+# language codes of subtitles
+LANG_CODES = frozenset(["aa","ab","ace","ady","af","ak","als","alt","am","an","ang","ar","arc","ary","arz","as","ast","atj","av","avk","awa","ay","az","azb","ba","ban","bar","bat-smg","bcl","be","be-tarask","bg","bh","bi","bjn","bm","bn","bo","bpy","br","bs","bug","bxr","ca","cbk-zam","cdo","ce","ceb","ch","cho","chr","chy","ckb","co","cr","crh","cs","csb","cu","cv","cy","da","de","din","diq","dsb","dty","dv","dz","ee","el","eml","en","eo","es","et","eu","ext","fa","ff","fi","fiu-vro","fj","fo","fr","frp","frr","fur","fy","ga","gag","gan","gcr","gd","gl","glk","gn","gom","gor","got","gu","gv","ha","hak","haw","he","hi","hif","ho","hr","hsb","ht","hu","hy","hyw","hz","ia","id","ie","ig","ii","ik","ilo","inh","io","is","it","iu","ja","jam","jbo","jv","ka","kaa","kab","kbd","kbp","kg","ki","kj","kk","kl","km","kn","ko","koi","kr","krc","ks","ksh","ku","kv","kw","ky","la","lad","lb","lbe","lez","lfn","lg","li","lij","lld","lmo","ln","lo","lrc","lt","ltg","lv","mad","mai","map-bms","mdf","mg","mh","mhr","mi","min","mk","ml","mn","mni","mnw","mr","mrj","ms","mt","mus","mwl","my","myv","mzn","na","nah","nap","nds","nds-nl","ne","new","ng","nia","nl","nn","no","nov","nqo","nrm","nso","nv","ny","oc","olo","om","or","os","pa","pag","pam","pap","pcd","pdc","pfl","pi","pih","pl","pms","pnb","pnt","ps","pt","qu","rm","rmy","rn","ro","roa-rup","roa-tara","ru","rue","rw","sa","sah","sat","sc","scn","sco","sd","se","sg","sh","shn","si","simple","sk","skr","sl","sm","smn","sn","so","sq","sr","srn","ss","st","stq","su","sv","sw","szl","szy","ta","tay","tcy","te","tet","tg","th","ti","tk","tl","tn","to","tpi","tr","trv","ts","tt","tum","tw","ty","tyv","udm","ug","uk","ur","uz","ve","vec","vep","vi","vls","vo","wa","war","wo","wuu","xal","xh","xmf","yi","yo","za","zea","zh","zh-classical","zh-min-nan",
+  "zh-yue","zu"])
 
-  return subtitle["auto"], subtitle["sub"]
 
+class YtdlError(Exception):
+  """yt-dlp failed for a video."""
+
+
+class VideoUnavailableError(YtdlError):
+  """The video is private, removed, blocked or members-only; retrying does not help."""
+
+
+class RateLimitedError(YtdlError):
+  """YouTube refused the request (HTTP 429 or bot check); retry later at a lower rate."""
+
+
+# messages of yt-dlp (from YouTube's playability status) for refused requests and for videos that will stay unavailable;
+# other errors, e.g. "Requested format is not available", may succeed on retry
+# YouTube also answers "Video unavailable" when throttling, so a bare "Video unavailable" is not permanent
+_RATE_LIMITED = re.compile(
+  r"HTTP Error 429|Too Many Requests|try again later|rate-limited by YouTube"
+  r"|Sign in to confirm you.re not a bot|confirm you.re not a robot|captcha", re.IGNORECASE)
+_UNAVAILABLE = re.compile(
+  r"Private video|This video is private|This video has been removed|This video is no longer available"
+  r"|This video is not available|account associated with this video has been terminated|members-only content"
+  r"|available to this channel's members|not made this video available in your country")
+
+
+def _ytdl_error(e: Exception) -> YtdlError:
+  msg = str(e)
+  if _RATE_LIMITED.search(msg):
+    return RateLimitedError(msg)
+  if _UNAVAILABLE.search(msg):
+    return VideoUnavailableError(msg)
+  return YtdlError(msg)
+
+
+class YtdlEngine:
+  """yt-dlp running in this process, with one long-lived YoutubeDL per thread.
+
+  Saves starting a yt-dlp process (and importing its extractors) for every video.
+  `params` are YoutubeDL options, e.g. "outtmpl" and "postprocessors" for downloading.
+  Failures are raised as YtdlError (VideoUnavailableError, RateLimitedError).
+  """
+  def __init__(self, **params):
+    self.params = {"quiet": True, "no_warnings": True, "noprogress": True, **params}
+    self._local = threading.local()
+
+  def _ydl(self):
+    ydl = getattr(self._local, "ydl", None)
+    if ydl is None:
+      from yt_dlp import YoutubeDL
+      ydl = self._local.ydl = YoutubeDL(self.params)
+    return ydl
+
+  def extract_info(self, videoid: str, download: bool = False, process: bool = True) -> dict:
+    from yt_dlp.utils import YoutubeDLError
+    try:
+      return self._ydl().extract_info(make_video_url(videoid), download=download, process=process)
+    except YoutubeDLError as e:
+      raise _ytdl_error(e) from e
+
+  def probe(self, videoid: str) -> dict:
+    # info dict of the video page only (no format selection, no download)
+    return self.extract_info(videoid, download=False, process=False)
+
+  def download(self, videoid: str) -> dict:
+    return self.extract_info(videoid, download=True)
+
+
+def _original_captions(captions: dict) -> set:
+  # automatic captions are the original track (speech recognition) and its machine translations to ~100 languages;
+  # yt-dlp lists the original also as "{lang}-orig", older versions only tell it by the missing "tlang" URL parameter
+  orig = set(l[:-len("-orig")] for l in captions if l.endswith("-orig"))
+  if len(orig) == 0:
+    orig = set(l for l, formats in captions.items() if not any("tlang=" in f.get("url", "") for f in formats or []))
+  return orig
+
+
+def subtitle_languages(info: dict):
+  # languages of automatic (original tracks only, no translations) and manual subtitles in an info dict of yt-dlp
+  auto_lang = set(l.lower() for l in _original_captions(info.get("automatic_captions") or {})) & LANG_CODES
+  manu_lang = set(l.lower() for l in (info.get("subtitles") or {})) & LANG_CODES
+  return auto_lang, manu_lang
+
+
+class RateLimiter:
+  """Token bucket shared by all workers of a process.
+
+  `rate` tokens are refilled per second up to `burst`. `acquire()` blocks until
+  a token is available, so the total request rate never exceeds `rate` no matter
+  how many threads are sending requests. A non-positive rate disables limiting.
+  After `backoff()`, all threads wait and continue at a lower rate.
+  """
+  def __init__(self, rate: float, burst: int = 1):
+    self.rate = rate
+    self.burst = max(1, burst)
+    self._tokens = float(self.burst)
+    self._last = time.monotonic()
+    self._resume = 0.0
+    self._lock = threading.Lock()
+
+  def acquire(self):
+    while True:
+      with self._lock:
+        now = time.monotonic()
+        if now < self._resume:
+          wait = self._resume - now
+        elif self.rate <= 0:
+          return
+        else:
+          self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+          self._last = now
+          if self._tokens >= 1.0:
+            self._tokens -= 1.0
+            return
+          wait = (1.0 - self._tokens) / self.rate
+      time.sleep(wait)
+
+  def backoff(self, pause: float = 60.0, factor: float = 0.5):
+    # the server refused a request (e.g. HTTP 429): hold all threads for `pause` seconds, then continue at `factor` * rate;
+    # threads refused during the same pause lower the rate only once
+    with self._lock:
+      now = time.monotonic()
+      if now < self._resume:
+        return
+      self._resume = now + pause
+      if self.rate > 0:
+        self.rate *= factor
+    print(f"Rate limited: waiting {pause:.0f} s" + (f", then at most {self.rate:.3g} requests/s." if self.rate > 0 else "."))
+
+
+def call_limited(func, *args, limiter: RateLimiter = None, retries: int = 3):
+  """Call `func(*args)` after `limiter.acquire()`.
+
+  On RateLimitedError, all threads of `limiter` back off (RateLimiter.backoff) and the call is retried
+  up to `retries` times.
+  """
+  for attempt in range(retries + 1):
+    if limiter is not None:
+      limiter.acquire()
+    try:
+      return func(*args)
+    except RateLimitedError:
+      if limiter is None or attempt == retries:
+        raise
+      limiter.backoff()
+
+
+def imap_ordered(func, iterable, workers: int = 1, window: int = None):
+  """Apply `func` to items of `iterable` on a thread pool and yield `(item, result)` in input order.
+
+  At most `window` items (default: 4 * workers) are in flight, so the input can be a lazy
+  iterator over millions of lines. With `workers <= 1`, items are processed in the caller thread.
+  """
+  if workers <= 1:
+    for item in iterable:
+      yield item, func(item)
+    return
+
+  window = window or 4 * workers
+  pending = deque()
+  with ThreadPoolExecutor(max_workers=workers) as executor:
+    for item in iterable:
+      pending.append((item, executor.submit(func, item)))
+      if len(pending) >= window:
+        item, future = pending.popleft()
+        yield item, future.result()
+    while len(pending) > 0:
+      item, future = pending.popleft()
+      yield item, future.result()
+
+
+class Journal:
+  """Per-item job states of a pipeline stage, stored in a SQLite file.
+
+  All stages can share one file; items are keyed by `(stage, item)`. An item is
+  "pending" while it is processed, and "done" or "failed" (with the reason) after.
+  `attempts` counts how often processing was started. Every update is committed at
+  once, so after a crash a stage restarts from the journal instead of re-scanning
+  its outputs. Items that are pending or failed are retried until `max_attempts`.
+  """
+  def __init__(self, fn_journal, stage: str, max_attempts: int = 3):
+    Path(fn_journal).parent.mkdir(parents=True, exist_ok=True)
+    self.stage = stage
+    self.max_attempts = max_attempts
+    self._lock = threading.Lock()
+    self._db = sqlite3.connect(str(fn_journal), timeout=60, check_same_thread=False)
+    self._db.execute("PRAGMA journal_mode=WAL")
+    self._db.execute("PRAGMA synchronous=NORMAL")
+    self._db.execute(
+      "CREATE TABLE IF NOT EXISTS journal ("
+      "stage TEXT, item TEXT, state TEXT, reason TEXT, attempts INTEGER, updated REAL, "
+      "PRIMARY KEY (stage, item)) WITHOUT ROWID")
+    self._db.commit()
+    self._states = {item: (state, attempts) for item, state, attempts in self._db.execute(
+      "SELECT item, state, attempts FROM journal WHERE stage = ?", (stage,))}
+
+  def __len__(self) -> int:
+    return len(self._states)
+
+  def __contains__(self, item: str) -> bool:
+    return item in self._states
+
+  def is_done(self, item: str) -> bool:
+    return self._states.get(item, (None, 0))[0] == "done"
+
+  def should_run(self, item: str) -> bool:
+    state, attempts = self._states.get(item, (None, 0))
+    return state != "done" and attempts < self.max_attempts
+
+  def start(self, item: str):
+    state, attempts = self._states.get(item, (None, 0))
+    self._update(item, "pending", None, attempts + 1)
+
+  def started(self, items):
+    # mark items as pending while they are handed over to workers
+    for item in items:
+      self.start(item)
+      yield item
+
+  def done(self, item: str):
+    self._update(item, "done", None, self._states.get(item, (None, 1))[1])
+
+  def failed(self, item: str, reason: str, retry: bool = True):
+    # retry=False: the item is not retried (e.g. the video is unavailable)
+    attempts = self._states.get(item, (None, 1))[1]
+    self._update(item, "failed", str(reason), attempts if retry else max(attempts, self.max_attempts))
+
+  def reset(self):
+    # forget all items of the stage, e.g. when its output is written anew
+    with self._lock:
+      self._states.clear()
+      self._db.execute("DELETE FROM journal WHERE stage = ?", (self.stage,))
+      self._db.commit()
+
+  def failed_items(self) -> dict:
+    return {item: reason for item, reason in self._db.execute(
+      "SELECT item, reason FROM journal WHERE stage = ? AND state = 'failed'", (self.stage,))}
+
+  def _update(self, item, state, reason, attempts):
+    with self._lock:
+      self._states[item] = (state, attempts)
+      self._db.execute(
+        "INSERT OR REPLACE INTO journal (stage, item, state, reason, attempts, updated) VALUES (?, ?, ?, ?, ?, ?)",
+        (self.stage, item, state, reason, attempts, time.time()))
+      self._db.commit()
+
+  def close(self):
+    self._db.close()
+
+
+class VideoIdIndex:
+  """Set of video IDs found so far, stored in a SQLite file shared by words, runs and languages.
+
+  `insert_new(videoids)` is a context manager: it inserts the IDs and gives the ones not seen before.
+  The insert is committed when the block exits, so IDs written inside the block are never lost
+  by a crash, and processes sharing the file never both get the same new ID.
+  """
+  def __init__(self, fn_index):
+    Path(fn_index).parent.mkdir(parents=True, exist_ok=True)
+    self._db = sqlite3.connect(str(fn_index), timeout=60, isolation_level=None)
+    self._db.execute("PRAGMA journal_mode=WAL")
+    self._db.execute("PRAGMA synchronous=NORMAL")
+    self._db.execute("CREATE TABLE IF NOT EXISTS videoid (videoid TEXT PRIMARY KEY, lang TEXT, added REAL) WITHOUT ROWID")
+
+  def __len__(self) -> int:
+    return self._db.execute("SELECT COUNT(*) FROM videoid").fetchone()[0]
+
+  def __contains__(self, videoid: str) -> bool:
+    return self._db.execute("SELECT 1 FROM videoid WHERE videoid = ?", (videoid,)).fetchone() is not None
+
+  @contextmanager
+  def insert_new(self, videoids: list, lang: str = None):
+    self._db.execute("BEGIN IMMEDIATE")
+    try:
+      new, now = [], time.time()
+      for videoid in videoids:
+        if self._db.execute("INSERT OR IGNORE INTO videoid VALUES (?, ?, ?)", (videoid, lang, now)).rowcount > 0:
+          new.append(videoid)
+      yield new
+    except BaseException:
+      self._db.execute("ROLLBACK")
+      raise
+    self._db.execute("COMMIT")
+
+  def close(self):
+    self._db.close()
+
+
+class MetadataStore:
+  """Subtitle languages, channel ID and duration per video, stored in a SQLite file shared by languages and runs.
+
+  One probe of a video page lists the subtitles of every language, so a video probed for one language is
+  never probed again for another. Automatic subtitles are stored in their original language only, not in the
+  languages YouTube can translate them to. Subtitle lists of any language are derived with `query(lang)`.
+  """
+  def __init__(self, fn_store):
+    Path(fn_store).parent.mkdir(parents=True, exist_ok=True)
+    self._lock = threading.Lock()
+    self._db = sqlite3.connect(str(fn_store), timeout=60, check_same_thread=False)
+    self._db.execute("PRAGMA journal_mode=WAL")
+    self._db.execute("PRAGMA synchronous=NORMAL")
+    self._db.execute(
+      "CREATE TABLE IF NOT EXISTS video ("
+      "videoid TEXT PRIMARY KEY, channelid TEXT, duration REAL, probed REAL) WITHOUT ROWID")
+    # probed is NULL for videos whose channel ID was resolved without probing subtitles
+    # kind: "auto" (automatic subtitle) or "sub" (manual subtitle)
+    self._db.execute(
+      "CREATE TABLE IF NOT EXISTS subtitle ("
+      "lang TEXT, kind TEXT, videoid TEXT, PRIMARY KEY (lang, kind, videoid)) WITHOUT ROWID")
+    self._db.commit()
+
+  def __len__(self) -> int:
+    with self._lock:
+      return self._db.execute("SELECT COUNT(*) FROM video WHERE probed IS NOT NULL").fetchone()[0]
+
+  def __contains__(self, videoid: str) -> bool:
+    with self._lock:
+      return self._db.execute(
+        "SELECT 1 FROM video WHERE videoid = ? AND probed IS NOT NULL", (videoid,)).fetchone() is not None
+
+  def put(self, videoid: str, auto_lang, manu_lang, channelid: str = None, duration: float = None):
+    with self._lock:
+      self._db.execute("DELETE FROM subtitle WHERE videoid = ?", (videoid,))
+      self._db.execute(
+        "INSERT INTO video VALUES (?, ?, ?, ?) ON CONFLICT (videoid) DO UPDATE SET "
+        "channelid = COALESCE(excluded.channelid, channelid), duration = excluded.duration, probed = excluded.probed",
+        (videoid, channelid, duration, time.time()))
+      self._db.executemany("INSERT OR IGNORE INTO subtitle VALUES (?, ?, ?)",
+        [(l, "auto", videoid) for l in auto_lang] + [(l, "sub", videoid) for l in manu_lang])
+      self._db.commit()
+
+  def get(self, videoid: str) -> dict:
+    # {"videoid", "auto": set, "sub": set, "channelid", "duration", "probed"}, or None if not probed
+    with self._lock:
+      row = self._db.execute(
+        "SELECT channelid, duration, probed FROM video WHERE videoid = ? AND probed IS NOT NULL", (videoid,)).fetchone()
+      if row is None:
+        return None
+      meta = {"videoid": videoid, "auto": set(), "sub": set(), "channelid": row[0], "duration": row[1], "probed": row[2]}
+      for lang, kind in self._db.execute("SELECT lang, kind FROM subtitle WHERE videoid = ?", (videoid,)):
+        meta[kind].add(lang)
+    return meta
+
+  def get_channelid(self, videoid: str) -> str:
+    # channel ID from a probe or set_channelid(), or None
+    with self._lock:
+      row = self._db.execute("SELECT channelid FROM video WHERE videoid = ?", (videoid,)).fetchone()
+    return row[0] if row is not None else None
+
+  def set_channelid(self, videoid: str, channelid: str):
+    with self._lock:
+      self._db.execute(
+        "INSERT INTO video (videoid, channelid) VALUES (?, ?) ON CONFLICT (videoid) DO UPDATE SET channelid = excluded.channelid",
+        (videoid, channelid))
+      self._db.commit()
+
+  def languages(self) -> list:
+    with self._lock:
+      return [l for l, in self._db.execute("SELECT DISTINCT lang FROM subtitle ORDER BY lang")]
+
+  def query(self, lang: str, videoids=None):
+    """Rows of a subtitle list: {"videoid", "auto", "sub", "channelid"}.
+
+    Without `videoids`, all probed videos with a subtitle in `lang`, in the order of video IDs.
+    With `videoids`, the probed ones of them (with or without subtitles), in the given order.
+    """
+    if videoids is None:
+      with self._lock:
+        rows = self._db.execute(
+          "SELECT v.videoid, MAX(s.kind = 'auto'), MAX(s.kind = 'sub'), v.channelid "
+          "FROM subtitle s JOIN video v ON s.videoid = v.videoid WHERE s.lang = ? "
+          "GROUP BY v.videoid ORDER BY v.videoid", (lang,)).fetchall()
+      for videoid, auto, sub, channelid in rows:
+        yield {"videoid": videoid, "auto": bool(auto), "sub": bool(sub), "channelid": channelid}
+      return
+    for videoid in videoids:
+      meta = self.get(videoid)
+      if meta is not None:
+        yield {"videoid": videoid, "auto": lang in meta["auto"], "sub": lang in meta["sub"], "channelid": meta["channelid"]}
+
+  def close(self):
+    self._db.close()
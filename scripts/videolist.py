@@ -0,0 +1,116 @@
+import argparse
+import sys
+import csv
+from pathlib import Path
+import pandas as pd
+
+try:
+  import pyarrow as pa
+  import pyarrow.compute as pc
+  import pyarrow.csv as pa_csv
+  import pyarrow.feather as feather
+  import pyarrow.parquet as pq
+  PYARROW_AVAILABLE = True
+except ImportError:
+  PYARROW_AVAILABLE = False
+
+COLUMNS = ["videoid", "auto", "sub", "channelid"]
+FORMATS = {"parquet": ".parquet", "feather": ".feather"}
+
+
+def parse_args():
+  parser = argparse.ArgumentParser(
+    description="Converting video lists (data/{lang}/*.csv) to Parquet or Feather.",
+    formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+  )
+  parser.add_argument("csv",      type=str, nargs="+", help="filenames of video lists")
+  parser.add_argument("--format", type=str, default="parquet", choices=list(FORMATS), help="output format")
+  return parser.parse_args(sys.argv[1:])
+
+
+def _arrow_types():
+  return {"videoid": pa.string(), "auto": pa.bool_(), "sub": pa.bool_(), "channelid": pa.dictionary(pa.int32(), pa.string())}
+
+
+def read_csv(fn_csv, columns=None):
+  # read a video list with pyarrow, dropping the index column written by pandas;
+  # a missing channel ID is null (as with pandas), not ""
+  with open(fn_csv, "r", newline="") as f:
+    header = next(csv.reader(f))
+  columns = [c for c in COLUMNS if c in header and (columns is None or c in columns)]
+  types = _arrow_types()
+  return pa_csv.read_csv(fn_csv, convert_options=pa_csv.ConvertOptions(
+    column_types={c: types[c] for c in columns}, include_columns=columns, strings_can_be_null=True))
+
+
+def convert_videolist(fn_csv, fmt="parquet"):
+  """
+  Tips:
+    Writes {fn_csv} as {stem}.parquet or {stem}.feather next to it, with bool `auto`/`sub` columns and a
+    dictionary-encoded (categorical) `channelid`. The index column written by pandas is dropped.
+    Feather files are written uncompressed, so that they can be memory-mapped.
+  """
+  table = read_csv(fn_csv)
+  fn_out = Path(fn_csv).with_suffix(FORMATS[fmt])
+  if fmt == "parquet":
+    pq.write_table(table, fn_out)
+  else:
+    feather.write_feather(table, fn_out, compression="uncompressed")
+  return fn_out
+
+
+def _make_filter(sub=None, auto=None, channelids=None):
+  expr = None
+  for e in [pc.field("sub") == sub if sub is not None else None,
+      pc.field("auto") == auto if auto is not None else None,
+      pc.field("channelid").isin(list(channelids)) if channelids is not None else None]:
+    if e is not None:
+      expr = e if expr is None else expr & e
+  return expr
+
+
+def load_videolist(fn, columns=None, sub=None, auto=None, channelids=None, memory_map=True) -> pd.DataFrame:
+  """
+  Tips:
+    Loads a video list (csv, parquet or feather) as a DataFrame; `channelid` is categorical.
+    Only rows with the given `sub`/`auto` values and channel IDs are returned, and only `columns` are read.
+    Parquet filters are evaluated while reading, and feather files are memory-mapped (memory_map=True).
+    CSV files can be loaded without pyarrow, but have to be parsed completely.
+  """
+  suffix = Path(fn).suffix
+  if suffix == ".csv" and not PYARROW_AVAILABLE:
+    df = pd.read_csv(fn)
+    mask = pd.Series(True, index=df.index)
+    if sub is not None:
+      mask &= df["sub"] == sub
+    if auto is not None:
+      mask &= df["auto"] == auto
+    if channelids is not None:
+      mask &= df["channelid"].isin(list(channelids))
+    df = df[mask].reset_index(drop=True)[columns or [c for c in COLUMNS if c in df.columns]]
+    if "channelid" in df.columns:
+      df["channelid"] = df["channelid"].astype("category")
+    return df
+
+  if not PYARROW_AVAILABLE:
+    raise ImportError(f"pyarrow is required to load {fn}.")
+  expr = _make_filter(sub, auto, channelids)
+  if suffix == ".parquet":
+    table = pq.read_table(fn, columns=columns, filters=expr, memory_map=memory_map)
+  elif suffix in [".csv", ".feather", ".arrow"]:
+    table = read_csv(fn) if suffix == ".csv" else feather.read_table(fn, memory_map=memory_map)
+    if expr is not None:
+      table = table.filter(expr)
+    if columns is not None:
+      table = table.select(columns)
+  else:
+    raise ValueError(f"Unknown format of video list: {fn}")
+  return table.to_pandas()
+
+
+if __name__ == "__main__":
+  args = parse_args()
+
+  for fn_csv in args.csv:
+    filename = convert_videolist(fn_csv, args.format)
+    print(f"save video list to {filename}.")